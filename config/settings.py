@@ -7,14 +7,20 @@
 - 默认值
 """
 
+import functools
+import hashlib
+import logging
 import os
-from dataclasses import dataclass
+import pickle
+from contextvars import ContextVar
+from dataclasses import dataclass, replace
+from pathlib import Path
 from typing import Optional
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class Config:
-    """应用配置"""
+    """应用配置（不可变，可安全地跨线程共享）"""
     
     # LLM设置
     llm_provider: str = "mock"  # "mock", "openai", "anthropic"
@@ -32,11 +38,13 @@ class Config:
     
     # 日志
     log_level: str = "INFO"
+    log_level_int: int = logging.INFO       # 数值形式，热路径比较用int而非字符串
     log_file: Optional[str] = None
     
     @classmethod
     def from_env(cls) -> "Config":
         """从环境变量加载配置"""
+        log_level = os.getenv("LOG_LEVEL", "INFO")
         return cls(
             llm_provider=os.getenv("LLM_PROVIDER", "mock"),
             llm_model=os.getenv("LLM_MODEL", "gpt-4"),
@@ -46,7 +54,9 @@ class Config:
             anthropic_api_key=os.getenv("ANTHROPIC_API_KEY"),
             max_guidance_attempts=int(os.getenv("MAX_GUIDANCE_ATTEMPTS", "5")),
             followup_questions_count=int(os.getenv("FOLLOWUP_QUESTIONS_COUNT", "3")),
-            log_level=os.getenv("LOG_LEVEL", "INFO"),
+            log_level=log_level,
+            # 字符串→int只在加载时转换一次
+            log_level_int=getattr(logging, log_level.upper(), logging.INFO),
             log_file=os.getenv("LOG_FILE")
         )
 
@@ -55,6 +65,92 @@ class Config:
 DEFAULT_CONFIG = Config()
 
 
-def get_config() -> Config:
-    """获取配置"""
+# ==================== 跨进程配置缓存（可选） ====================
+
+# 配置会读取的环境变量——缓存key只对这些取哈希，其他环境变量变化不会使缓存失效
+_CONFIG_ENV_VARS = (
+    "LLM_PROVIDER", "LLM_MODEL", "LLM_TEMPERATURE", "LLM_MAX_TOKENS",
+    "OPENAI_API_KEY", "ANTHROPIC_API_KEY",
+    "MAX_GUIDANCE_ATTEMPTS", "FOLLOWUP_QUESTIONS_COUNT",
+    "LOG_LEVEL", "LOG_FILE",
+)
+
+_CONFIG_CACHE_DIR = Path.home() / ".cache" / "dm"
+
+
+def _config_cache_path() -> Path:
+    """按相关环境变量哈希生成缓存文件路径"""
+    key_source = repr(tuple(os.getenv(var) for var in _CONFIG_ENV_VARS))
+    key = hashlib.sha256(key_source.encode()).hexdigest()[:16]
+    return _CONFIG_CACHE_DIR / f"config-{key}.pkl"
+
+
+def _strip_secrets(config: Config) -> Config:
+    """去掉不落盘的敏感字段（API key只存在于环境变量中）"""
+    return replace(config, openai_api_key=None, anthropic_api_key=None)
+
+
+def _restore_secrets(config: Config) -> Config:
+    """从环境变量补回敏感字段"""
+    return replace(
+        config,
+        openai_api_key=os.getenv("OPENAI_API_KEY"),
+        anthropic_api_key=os.getenv("ANTHROPIC_API_KEY"),
+    )
+
+
+def _load_config_with_disk_cache() -> Config:
+    """从磁盘缓存加载配置，失败则重新解析（均为尽力而为）
+
+    缓存文件不含API key：落盘前剥除，加载后从环境变量补回，
+    避免明文key躺在 ~/.cache 里。
+    """
+    path = _config_cache_path()
+    try:
+        with open(path, "rb") as f:
+            return _restore_secrets(pickle.load(f))
+    except Exception:
+        pass
+
+    config = Config.from_env()
+    try:
+        _CONFIG_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        with open(path, "wb") as f:
+            pickle.dump(_strip_secrets(config), f)
+    except OSError:
+        pass
+    return config
+
+
+# 当前上下文的配置覆盖（线程/异步任务隔离，用于按请求定制配置）
+_CONFIG_VAR: ContextVar[Optional[Config]] = ContextVar("config", default=None)
+
+
+@functools.lru_cache(maxsize=1)
+def _load_global_config() -> Config:
+    """加载全局配置（进程内只解析一次）
+
+    需要重新加载时（如测试中修改了环境变量），
+    调用 _load_global_config.cache_clear() 即可。
+    """
+    if os.getenv("DM_CONFIG_CACHE") == "1":
+        return _load_config_with_disk_cache()
     return Config.from_env()
+
+
+def get_config() -> Config:
+    """获取配置
+
+    优先返回当前上下文通过 set_config() 设置的覆盖配置，
+    否则返回缓存的全局配置。设置 DM_CONFIG_CACHE=1 可启用
+    磁盘缓存，短生命周期的CLI进程可跳过重复解析。
+    """
+    override = _CONFIG_VAR.get()
+    if override is not None:
+        return override
+    return _load_global_config()
+
+
+def set_config(config: Optional[Config]):
+    """在当前上下文中覆盖配置（传None恢复全局配置）"""
+    _CONFIG_VAR.set(config)
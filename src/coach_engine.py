@@ -17,18 +17,237 @@
 3. 所有回复由LLM动态生成
 """
 
+import asyncio
+import hashlib
 import logging
-from typing import Dict, Optional, Tuple
+import math
+import re
+import time
+from collections import OrderedDict
+from functools import cached_property
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
 from src.models import (
     Session, SessionPhase, Problem, UserIntent, 
     CodeEvaluation, LLMResponse, create_session
 )
-from src.prompt_library import PromptLibrary, get_prompt_library
+from src.prompt_library import PromptLibrary, get_prompt_library, RESPONSE_SCHEMAS
 from src.llm_client import BaseLLMClient, get_llm_client
+from src.local_runner import evaluate_code_locally
 
 logger = logging.getLogger(__name__)
 
 
+# ==================== 意图识别关键词（模块加载时构建一次） ====================
+
+# 跳过关键词
+_SKIP_KEYWORDS = ("跳过", "换题", "skip", "next", "下一题")
+
+# 帮助关键词
+_HELP_KEYWORDS = ("帮助", "提示", "hint", "help", "不会", "不知道", "给我提示", "怎么做")
+
+# 代码特征（区分大小写，避免误判普通英文）
+_CODE_INDICATORS = ("def ", "function", "class ", "for ", "while ", "if ", "return", "=>", "```")
+
+# 跳过/帮助关键词合并为一个带命名组的交替式：C层一次扫描同时
+# 识别两类关键词，替代逐类的多次全文扫描
+_INTENT_RE = re.compile(
+    "(?P<skip>{})|(?P<help>{})".format(
+        "|".join(map(re.escape, _SKIP_KEYWORDS)),
+        "|".join(map(re.escape, _HELP_KEYWORDS)),
+    ),
+    re.IGNORECASE,
+)
+_CODE_RE = re.compile("|".join(map(re.escape, _CODE_INDICATORS)))
+
+# 用于判断输入是否含大写ASCII——没有时无需lower()拷贝
+_UPPER_ASCII_RE = re.compile(r"[A-Z]")
+
+# 可选：pyahocorasick 自动机，一次线性扫描匹配全部跳过/帮助关键词
+# （关键词列表扩展时仍保持 O(n)；未安装时回退到上面的正则）
+_INTENT_AUTOMATON = None
+try:
+    import ahocorasick
+
+    _INTENT_AUTOMATON = ahocorasick.Automaton()
+    for _intent, _keywords in (
+        ("skip_problem", _SKIP_KEYWORDS),
+        ("ask_for_help", _HELP_KEYWORDS),
+    ):
+        for _kw in _keywords:
+            _INTENT_AUTOMATON.add_word(_kw, _intent)
+    _INTENT_AUTOMATON.make_automaton()
+except ImportError:
+    pass
+
+
+def _match_intent_keywords(user_input: str):
+    """扫描跳过/帮助关键词，返回意图字符串或None"""
+    # 两条路径都只对输入做一次线性扫描；跳过意图优先，
+    # 命中即提前结束
+    if _INTENT_AUTOMATON is not None:
+        # 自动机中的ASCII关键词均为小写；只有输入确实含大写时才做lower()拷贝
+        haystack = user_input.lower() if _UPPER_ASCII_RE.search(user_input) else user_input
+        found_help = False
+        for _, intent in _INTENT_AUTOMATON.iter(haystack):
+            if intent == "skip_problem":
+                return "skip_problem"
+            found_help = True
+        return "ask_for_help" if found_help else None
+
+    found_help = False
+    for match in _INTENT_RE.finditer(user_input):
+        if match.lastgroup == "skip":
+            return "skip_problem"
+        found_help = True
+    return "ask_for_help" if found_help else None
+
+
+def match_quick_intent(user_input: str) -> Optional[str]:
+    """快速关键词意图匹配（不调用LLM）
+
+    返回 "skip_problem" / "ask_for_help" / None。
+    供CLI等上层做投机预取时的轻量判断。
+    """
+    return _match_intent_keywords(user_input)
+
+
+class SessionStore:
+    """
+    有界会话存储（LRU + TTL）
+
+    长时间运行的服务中，会话若永久驻留内存会无限增长。
+    这里按最近访问排序，超过容量淘汰最久未用的会话，
+    超过TTL的空闲会话在访问时被清理。
+    """
+
+    def __init__(self, maxsize: int = 10_000, ttl: float = 3600.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, Tuple[float, Session]]" = OrderedDict()
+
+    def __setitem__(self, session_id: str, session: Session):
+        self._expire()
+        self._entries[session_id] = (time.monotonic(), session)
+        self._entries.move_to_end(session_id)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        """清空所有会话"""
+        self._entries.clear()
+
+    def get(self, session_id: str) -> Optional[Session]:
+        entry = self._entries.get(session_id)
+        if entry is None:
+            return None
+        stored_at, session = entry
+        if time.monotonic() - stored_at > self.ttl:
+            del self._entries[session_id]
+            return None
+        # 刷新访问时间
+        self._entries[session_id] = (time.monotonic(), session)
+        self._entries.move_to_end(session_id)
+        return session
+
+    def __contains__(self, session_id: str) -> bool:
+        return self.get(session_id) is not None
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _expire(self):
+        """清理过期会话"""
+        now = time.monotonic()
+        while self._entries:
+            session_id, (stored_at, _) = next(iter(self._entries.items()))
+            if now - stored_at <= self.ttl:
+                break
+            del self._entries[session_id]
+
+
+class SemanticReplyCache:
+    """
+    跨会话的回复缓存：先精确匹配，再按embedding余弦相似度匹配
+
+    "给我提示"、"不太明白"这类高频近似输入在同一道题、同一阶段下
+    往往应得到同样的回复。key中带上题目/阶段/进度上下文，保证只
+    复用语境完全相同的回复；命中时省去整次LLM调用。
+    缓存值可以是回复文本，也可以是可整体复用的结构化结果
+    （如意图识别的 (intent, reply) 对）。
+
+    embed_fn 可选（如DashScope text-embedding），不提供时退化为
+    纯精确匹配。
+    """
+
+    def __init__(
+        self,
+        embed_fn: Callable[[str], Sequence[float]] = None,
+        threshold: float = 0.92,
+        maxsize: int = 2048
+    ):
+        self.embed_fn = embed_fn
+        self.threshold = threshold
+        self.maxsize = maxsize
+        self.stats = {"hits": 0, "misses": 0}
+        self._exact: "OrderedDict[str, Any]" = OrderedDict()
+        # 语义索引：上下文 + 归一化向量 + 回复（平行列表，超容量淘汰最旧）
+        self._contexts: List[str] = []
+        self._embeddings: List[List[float]] = []
+        self._replies: List[Any] = []
+
+    @staticmethod
+    def _key(context: str, text: str) -> str:
+        normalized = text.strip().lower()
+        return hashlib.sha1(f"{context}\x00{normalized}".encode()).hexdigest()
+
+    @staticmethod
+    def _normalize(vector: Sequence[float]) -> List[float]:
+        norm = math.sqrt(sum(x * x for x in vector))
+        if norm == 0:
+            return list(vector)
+        return [x / norm for x in vector]
+
+    def get(self, context: str, text: str) -> Optional[Any]:
+        """查缓存：精确命中 → 同上下文内语义相似命中 → None"""
+        key = self._key(context, text)
+        reply = self._exact.get(key)
+        if reply is not None:
+            self.stats["hits"] += 1
+            self._exact.move_to_end(key)
+            return reply
+
+        if self.embed_fn is not None and self._replies:
+            query = self._normalize(self.embed_fn(text))
+            best_idx, best_score = None, self.threshold
+            for i, emb in enumerate(self._embeddings):
+                if self._contexts[i] != context:
+                    continue
+                score = sum(a * b for a, b in zip(emb, query))
+                if score >= best_score:
+                    best_idx, best_score = i, score
+            if best_idx is not None:
+                self.stats["hits"] += 1
+                return self._replies[best_idx]
+
+        self.stats["misses"] += 1
+        return None
+
+    def put(self, context: str, text: str, reply: Any):
+        """写入缓存"""
+        self._exact[self._key(context, text)] = reply
+        if len(self._exact) > self.maxsize:
+            self._exact.popitem(last=False)
+
+        if self.embed_fn is not None:
+            self._contexts.append(context)
+            self._embeddings.append(self._normalize(self.embed_fn(text)))
+            self._replies.append(reply)
+            if len(self._replies) > self.maxsize:
+                self._contexts.pop(0)
+                self._embeddings.pop(0)
+                self._replies.pop(0)
+
+
 class CoachEngine:
     """
     教练引擎
@@ -39,15 +258,135 @@ class CoachEngine:
     3. 实现教学流程
     """
     
+    # 响应缓存容量（LRU）
+    RESPONSE_CACHE_SIZE = 256
+
+    # 草稿模型投机路径：分类类调用置信度达到该阈值时直接采纳小模型结果
+    DRAFT_CONFIDENCE = 0.85
+    # 分类输出很短（枚举+一句理由），草稿调用收紧token上限
+    DRAFT_MAX_TOKENS = 150
+
+    # 滚动摘要：未覆盖消息积累到该条数时触发一次压缩
+    SUMMARY_TRIGGER = 16
+    # 摘要不覆盖最近的消息（它们仍在token预算内原样进入上下文）
+    SUMMARY_KEEP_RECENT = 10
+
     def __init__(
-        self, 
+        self,
         llm_client: BaseLLMClient = None,
-        prompt_library: PromptLibrary = None
+        prompt_library: PromptLibrary = None,
+        cache_llm_responses: bool = False,
+        semantic_cache: SemanticReplyCache = None
     ):
-        self.llm = llm_client or get_llm_client()
-        self.prompts = prompt_library or get_prompt_library()
-        self.sessions: Dict[str, Session] = {}
+        # 延迟到首次使用时再构造LLM客户端/Prompt库，加快导入和启动
+        self._llm_override = llm_client
+        self._prompts_override = prompt_library
+        self.sessions = SessionStore()
+        # 相同prompt的JSON响应缓存（仅在LLM输出确定时开启，如temperature=0）
+        self.cache_llm_responses = cache_llm_responses
+        self._response_cache: "OrderedDict[str, Dict]" = OrderedDict()
+        # 题目开场白缓存（开场白只由题目决定，每道题渲染一次）
+        self._opening_cache: Dict[str, str] = {}
+        # 可选的跨会话语义回复缓存（只缓存未改变会话状态的轮次）
+        self._semantic_cache = semantic_cache
+
+    @cached_property
+    def llm(self) -> BaseLLMClient:
+        """LLM客户端（首次访问时初始化）"""
+        return self._llm_override or get_llm_client()
+
+    @cached_property
+    def prompts(self) -> PromptLibrary:
+        """Prompt库（首次访问时初始化）"""
+        return self._prompts_override or get_prompt_library()
     
+    def _call_json(self, prompt: str, draft: bool = False, session: Session = None,
+                   schema: Dict = None) -> Dict:
+        """调用LLM并解析JSON，可选地按prompt缓存响应
+
+        识别、引导等场景中相同的prompt会重复出现，
+        缓存命中时省去一次完整的LLM往返。
+
+        draft=True表示分类类调用（意图识别、代码判定）：
+        配置了draft_model时先用小模型投机执行，返回的
+        confidence达标就直接采纳，否则再用主模型复核。
+        用户可见的回复生成始终走主模型。
+
+        传session时会按阶段降档模型（见LLMConfig.model_by_phase），
+        并把prompt的静态前缀拆成system prompt以命中provider端前缀缓存。
+        传schema时，支持结构化输出的provider会按它强制返回形状。
+        """
+        if not self.cache_llm_responses:
+            return self._invoke_json(prompt, draft, session, schema)
+
+        cached = self._response_cache.get(prompt)
+        if cached is not None:
+            self._response_cache.move_to_end(prompt)
+            return cached
+
+        response = self._invoke_json(prompt, draft, session, schema)
+        self._response_cache[prompt] = response
+        if len(self._response_cache) > self.RESPONSE_CACHE_SIZE:
+            self._response_cache.popitem(last=False)
+        return response
+
+    def _invoke_json(self, prompt: str, draft: bool = False, session: Session = None,
+                     schema: Dict = None) -> Dict:
+        """发起一次JSON调用，分类类调用优先走草稿模型
+
+        仅对暴露config的provider客户端生效的优化：
+        1. prompt的逐字节稳定前缀拆成system prompt（provider前缀缓存）；
+        2. draft=True且配置了draft_model → 小模型投机，置信度达标即采纳；
+        3. 配置了model_by_phase → 按阶段选最小够用的模型；
+        否则原样走config.model。
+        """
+        config = getattr(self.llm, "config", None)
+        if config is None:
+            return self.llm.call_json(prompt)
+
+        # provider客户端的call_json签名统一接受schema
+        extra = {"schema": schema} if schema is not None else {}
+
+        system_prompt = None
+        if session is not None and session.problem is not None:
+            prompt, system_prompt = self._split_static_prefix(prompt, session.problem)
+
+        if draft:
+            draft_model = getattr(config, "draft_model", None)
+            if draft_model:
+                try:
+                    data = self.llm.call_json(
+                        prompt, system_prompt=system_prompt,
+                        model=draft_model, max_tokens=self.DRAFT_MAX_TOKENS,
+                        **extra
+                    )
+                    if float(data.get("confidence", 1.0)) >= self.DRAFT_CONFIDENCE:
+                        return data
+                except Exception as e:
+                    logger.warning("草稿模型调用失败，回退主模型: %s", e)
+        if session is not None and config.model_by_phase:
+            model = config.model_for_phase(session.phase)
+            if model != config.model:
+                return self.llm.call_json(
+                    prompt, system_prompt=system_prompt, model=model, **extra
+                )
+        return self.llm.call_json(prompt, system_prompt=system_prompt, **extra)
+
+    def _split_static_prefix(self, prompt: str, problem) -> tuple:
+        """把prompt开头的稳定前缀拆出来作为system prompt
+
+        前缀在会话期间逐字节不变，单独作为system prompt发送可让
+        provider端前缀缓存每轮命中。未命中任何已知前缀时原样返回。
+        """
+        for prefix in self.prompts.get_static_prefixes(problem):
+            if prompt.startswith(prefix):
+                return prompt[len(prefix):].lstrip("\n"), prefix
+        return prompt, None
+
+    def clear_response_cache(self):
+        """清空LLM响应缓存"""
+        self._response_cache.clear()
+
     # ==================== 会话管理 ====================
     
     def create_session(self, session_id: str = None) -> Session:
@@ -55,6 +394,10 @@ class CoachEngine:
         session = create_session(session_id)
         self.sessions[session.session_id] = session
         return session
+
+    def reset_sessions(self):
+        """清空所有会话（测试间复用引擎实例）"""
+        self.sessions.clear()
     
     def get_session(self, session_id: str) -> Optional[Session]:
         """获取会话"""
@@ -81,15 +424,19 @@ class CoachEngine:
         return opening
     
     def _generate_opening(self, session: Session) -> str:
-        """生成题目开场白"""
+        """生成题目开场白（按题目缓存，重复选题时直接复用）"""
         problem = session.problem
-        return f"""好的，让我们来看这道题：
+        opening = self._opening_cache.get(problem.title)
+        if opening is None:
+            opening = f"""好的，让我们来看这道题：
 
 **{problem.title}**
 
 {problem.description}
 
 你可以先想一想，然后把你的代码或思路告诉我。如果需要提示，随时可以问我！"""
+            self._opening_cache[problem.title] = opening
+        return opening
     
     # ==================== 主处理流程 ====================
     
@@ -107,39 +454,181 @@ class CoachEngine:
         session = self.get_session(session_id)
         if not session:
             raise ValueError(f"Session {session_id} not found")
-        
-        # 记录用户输入
-        session.add_message("user", user_input)
-        
-        # 根据当前阶段处理
-        phase = session.phase
-        
-        if phase == SessionPhase.WAITING_PROBLEM:
-            reply = self._handle_waiting_problem(session, user_input)
-        
-        elif phase == SessionPhase.WAITING_CODE:
-            reply = self._handle_waiting_code(session, user_input)
-        
-        elif phase == SessionPhase.GUIDING:
-            reply = self._handle_guiding(session, user_input)
-        
-        elif phase == SessionPhase.FOLLOWUP:
-            reply = self._handle_followup(session, user_input)
-        
-        elif phase == SessionPhase.TEACHING:
-            reply = self._handle_teaching(session, user_input)
-        
-        elif phase == SessionPhase.COMPLETED:
-            reply = self._handle_completed(session, user_input)
-        
+
+        # 惰性格式化：仅在DEBUG级别开启时才求值
+        logger.debug("process_input: session=%s phase=%s", session_id, session.phase)
+
+        # 语义缓存：key带上题目/阶段/进度，只在语境完全相同时复用
+        cache_context = None
+        if self._semantic_cache is not None and session.problem is not None:
+            cache_context = "|".join((
+                session.problem.title,
+                session.phase.name,
+                str(session.guidance_state.attempt_count),
+                str(session.followup_state.questions_asked),
+            ))
+            cached = self._semantic_cache.get(cache_context, user_input)
+            if cached is not None:
+                session.add_exchange(user_input, cached)
+                return cached
+
+        # 会话状态快照：处理器改变了状态的轮次不可跨会话复用
+        state_before = (
+            session.phase,
+            session.guidance_state.attempt_count,
+            session.followup_state.questions_asked,
+        )
+
+        # 根据当前阶段分发到对应处理器
+        handler = self._PHASE_HANDLERS.get(session.phase)
+        if handler is not None:
+            reply = handler(self, session, user_input)
         else:
             reply = "抱歉，出现了一些问题。让我们重新开始。"
             session.reset_for_new_problem()
-        
-        # 记录回复
-        session.add_message("assistant", reply)
-        
+
+        # 只缓存纯问答轮次：状态有变化说明回复与转换绑定，直接复用会
+        # 让命中方跳过状态转换
+        if cache_context is not None and (
+            session.phase,
+            session.guidance_state.attempt_count,
+            session.followup_state.questions_asked,
+        ) == state_before:
+            self._semantic_cache.put(cache_context, user_input, reply)
+        
+        # 一次性记录本轮问答
+        session.add_exchange(user_input, reply)
+        self._maybe_summarize(session)
+
+        return reply
+
+    def _maybe_summarize(self, session: Session):
+        """把淡出token预算的旧对话压缩成滚动摘要
+
+        每积累约SUMMARY_TRIGGER条未覆盖的消息才触发一次，摘要调用
+        的代价被多轮摊薄。摘要存回Session，构建上下文时置于最前，
+        这样即使旧消息被预算截掉，关键结论也不会丢失。
+        """
+        # 用单调递增的_msg_seq计量覆盖进度：deque长度在达到上限后
+        # 饱和，用它做基准会让长会话的backlog永远凑不满触发阈值
+        backlog = session._msg_seq - session.summary_upto_idx
+        if backlog < self.SUMMARY_TRIGGER:
+            return
+
+        # 只摘要尚未覆盖的片段，已覆盖的部分由已有摘要承载，
+        # 每次触发的转写成本与新增消息数成正比而非全量transcript
+        deque_start = session._msg_seq - len(session.messages)
+        skip = max(0, session.summary_upto_idx - deque_start)
+        old_messages = list(session.messages)[skip:-self.SUMMARY_KEEP_RECENT]
+        if not old_messages:
+            return
+
+        transcript = "\n".join(f"{m.role}: {m.content}" for m in old_messages)
+        prefix = f"已有摘要：{session.rolling_summary}\n\n" if session.rolling_summary else ""
+        prompt = (
+            "请把以下面试辅导对话压缩成不超过200字的摘要，"
+            "保留解题思路、已给过的提示和用户的关键结论：\n\n"
+            f"{prefix}{transcript}"
+        )
+        try:
+            session.rolling_summary = self.llm.call(prompt)
+            session.summary_upto_idx = session._msg_seq - self.SUMMARY_KEEP_RECENT
+        except Exception:
+            # 摘要失败不影响本轮对话，下次再试
+            logger.warning("rolling summary failed", exc_info=True)
+
+    def prefetch_candidates(self, session_id: str) -> List[str]:
+        """下一轮真实调用会作为system prompt发送的稳定前缀（投机预热用）
+
+        等待代码/引导阶段的下一条输入大概率是继续讨论思路（引导）
+        或提交代码（代码评估）。对这两个builder的静态头部做与真实
+        调用相同的前缀拆分，返回拆出的前缀——provider端缓存要求
+        逐字节一致，预热必须发送和之后完全相同的串才会被命中。
+        """
+        session = self.get_session(session_id)
+        if not session or not session.problem or session.phase not in (
+            SessionPhase.WAITING_CODE, SessionPhase.GUIDING
+        ):
+            return []
+        prefixes: List[str] = []
+        for head in self.prompts.get_candidate_heads(session.problem):
+            _, prefix = self._split_static_prefix(head, session.problem)
+            if prefix is not None and prefix not in prefixes:
+                prefixes.append(prefix)
+        return prefixes
+
+    def warm_prompt_cache(self, session_id: str) -> None:
+        """用户打字期间把候选prompt前缀写入provider端缓存
+
+        真实提交到达时这些前缀作为system prompt逐字节命中，
+        prefill按缓存价计费、首token更快。Mock等无配置客户端跳过。
+        """
+        if getattr(self.llm, "config", None) is None:
+            return
+        for head in self.prefetch_candidates(session_id):
+            self.llm.warm_prefix(head)
+
+    def prefetch_help_reply(self, session_id: str) -> Optional[str]:
+        """后台预生成"请求提示"场景的回复（投机执行）
+
+        用户打字的几秒钟里LLM本来是空闲的；CLI可在此期间预取
+        提示回复，用户真的请求帮助时延迟为零。本方法不改变
+        会话状态，结果需通过 consume_prefetched_help() 提交。
+        """
+        session = self.get_session(session_id)
+        if not session or session.phase not in (
+            SessionPhase.WAITING_CODE, SessionPhase.GUIDING
+        ):
+            return None
+        prompt = self.prompts.get_help_request_prompt(session, "请给我一些提示")
+        response = LLMResponse.from_json(self._call_json(prompt, session=session))
+        return response.reply or None
+
+    def consume_prefetched_help(
+        self, session_id: str, user_input: str, reply: str
+    ) -> Optional[str]:
+        """把预取的提示回复作为本轮结果提交
+
+        状态更新与常规帮助轮次一致（进入/推进引导、记录问答）。
+        会话状态已不适合直接套用时返回None，调用方走常规处理。
+        """
+        session = self.get_session(session_id)
+        if not session:
+            return None
+
+        if session.phase == SessionPhase.WAITING_CODE:
+            session.start_guidance()
+            session.guidance_state.increment_attempt()
+        elif session.phase == SessionPhase.GUIDING:
+            if session.guidance_state.is_exhausted():
+                return None
+            if not session.guidance_state.increment_attempt():
+                # 这是最后一次机会，教学转换需要走常规流程
+                pass
+        else:
+            return None
+
+        session.add_exchange(user_input, reply)
+        self._maybe_summarize(session)
         return reply
+
+    async def aprocess_input(self, session_id: str, user_input: str) -> str:
+        """异步处理用户输入
+
+        处理逻辑在工作线程执行，事件循环不被阻塞——并发会话
+        （或并发测试）的轮次可以相互重叠。
+        """
+        return await asyncio.to_thread(self.process_input, session_id, user_input)
+
+    def process_input_stream(self, session_id: str, user_input: str):
+        """流式处理用户输入，逐段产出教练回复
+
+        回复由结构化JSON调用驱动（需要完整解析才能决定状态转换），
+        因此目前整段产出；接口做成生成器是为了让CLI等上层边收边渲染，
+        后续支持流式产出的处理器无需改动调用方。网络层的流式接收
+        由 LLMConfig.stream 控制。
+        """
+        yield self.process_input(session_id, user_input)
     
     # ==================== 各阶段处理器 ====================
     
@@ -167,6 +656,12 @@ class CoachEngine:
         elif intent == UserIntent.ASK_FOR_HELP:
             # 用户请求帮助，直接进入引导
             session.start_guidance()
+            # 意图识别由LLM完成时，其reply已按提示强度给出引导，
+            # 直接采用，省掉原先紧随其后的第二次帮助调用；
+            # 关键词快速路径没有reply，仍走帮助prompt
+            if intent_reply:
+                session.guidance_state.increment_attempt()
+                return intent_reply
             return self._handle_help_request(session, user_input)
         
         elif intent == UserIntent.SKIP_PROBLEM:
@@ -204,10 +699,12 @@ class CoachEngine:
         
         # 进行引导对话
         prompt = self.prompts.get_guidance_prompt(session, user_input)
-        response = self.llm.call_json(prompt)
-        
-        reply = response.get("reply", "让我们换个角度想想...")
-        on_track = response.get("user_on_right_track", False)
+        response = LLMResponse.from_json(
+            self._call_json(prompt, session=session, schema=RESPONSE_SCHEMAS["guidance"])
+        )
+
+        reply = response.reply or "让我们换个角度想想..."
+        on_track = response.user_on_right_track
         
         # 增加尝试次数
         has_attempts = session.guidance_state.increment_attempt()
@@ -251,15 +748,16 @@ class CoachEngine:
             user_input,
             current_q_num
         )
-        response = self.llm.call_json(prompt)
-        
-        reply = response.get("reply", "")
-        
+        response = LLMResponse.from_json(
+            self._call_json(prompt, session=session, schema=RESPONSE_SCHEMAS["followup_eval"])
+        )
+
+        reply = response.reply
+
         # 检查是否还有下一个追问
         if current_q_num < followup_state.total_questions:
-            next_q = response.get("next_question", "")
-            if next_q:
-                followup_state.add_question(next_q)
+            if response.next_question:
+                followup_state.add_question(response.next_question)
         
         # 检查是否完成
         if followup_state.is_complete():
@@ -281,7 +779,17 @@ class CoachEngine:
     def _handle_completed(self, session: Session, user_input: str) -> str:
         """处理已完成阶段"""
         return "这道题我们已经讨论完了。你想继续练习下一道题吗？"
-    
+
+    # 阶段 → 处理器分发表（O(1)查找，替代if/elif链）
+    _PHASE_HANDLERS = {
+        SessionPhase.WAITING_PROBLEM: _handle_waiting_problem,
+        SessionPhase.WAITING_CODE: _handle_waiting_code,
+        SessionPhase.GUIDING: _handle_guiding,
+        SessionPhase.FOLLOWUP: _handle_followup,
+        SessionPhase.TEACHING: _handle_teaching,
+        SessionPhase.COMPLETED: _handle_completed,
+    }
+
     # ==================== 辅助方法 ====================
     
     def _recognize_intent(self, session: Session, user_input: str) -> Tuple[UserIntent, str]:
@@ -291,37 +799,50 @@ class CoachEngine:
         Returns:
             (意图, LLM生成的回复)
         """
-        # 快速规则判断
-        input_lower = user_input.lower().strip()
-        
-        # 跳过关键词
-        skip_keywords = ["跳过", "换题", "skip", "next", "下一题"]
-        if any(kw in input_lower for kw in skip_keywords):
+        # 快速路径：粘贴的代码块几乎都以fence或def/class开头，
+        # 只检查有界前缀即可判定，无需扫描整段长文本
+        if "```" in user_input[:64] or user_input.lstrip()[:6].startswith(("def ", "class ")):
+            return UserIntent.SUBMIT_CODE, ""
+
+        # 快速规则判断（单次扫描匹配全部关键词）
+        keyword_intent = _match_intent_keywords(user_input)
+        if keyword_intent == "skip_problem":
             return UserIntent.SKIP_PROBLEM, ""
-        
-        # 帮助关键词
-        help_keywords = ["帮助", "提示", "hint", "help", "不会", "不知道", "给我提示", "怎么做"]
-        if any(kw in input_lower for kw in help_keywords):
+        if keyword_intent == "ask_for_help":
             return UserIntent.ASK_FOR_HELP, ""
-        
+
         # 代码特征检测
-        code_indicators = ["def ", "function", "class ", "for ", "while ", "if ", "return", "=>", "```"]
-        if any(ind in user_input for ind in code_indicators):
+        if _CODE_RE.search(user_input):
             return UserIntent.SUBMIT_CODE, ""
-        
+
+        # 语义缓存："给我提示"、"不太明白"这类高频说法在同一道题、
+        # 同一阶段下的意图判定可以整体复用，省掉一次LLM分类调用
+        intent_context = None
+        if self._semantic_cache is not None and session.problem is not None:
+            intent_context = "|".join(
+                ("intent", session.problem.title, session.phase.name)
+            )
+            cached = self._semantic_cache.get(intent_context, user_input)
+            if cached is not None:
+                return UserIntent[cached[0]], cached[1]
+
         # 使用LLM识别
         prompt = self.prompts.get_intent_recognition_prompt(session, user_input)
-        response = self.llm.call_json(prompt)
-        
-        intent_str = response.get("intent", "other")
-        reply = response.get("reply", "")
-        
+        response = LLMResponse.from_json(
+            self._call_json(prompt, draft=True, session=session,
+                            schema=RESPONSE_SCHEMAS["intent"])
+        )
+
         try:
-            intent = UserIntent(intent_str)
-        except ValueError:
+            intent = UserIntent[str(response.intent).upper()]
+        except KeyError:
+            # LLM返回了未知意图（或非字符串），与基线行为一致地兜底
             intent = UserIntent.OTHER
-        
-        return intent, reply
+
+        if intent_context is not None:
+            self._semantic_cache.put(intent_context, user_input, (intent.name, response.reply))
+
+        return intent, response.reply
     
     def _evaluate_and_respond(self, session: Session, user_input: str) -> str:
         """
@@ -333,13 +854,33 @@ class CoachEngine:
         """
         # 保存用户代码
         session.user_code = user_input
-        
+
+        # 本地判题快路径：接真实provider时先在沙箱里跑测试用例，
+        # 确定性的"错误"结论直接带着失败用例进入引导，省掉一次
+        # 让LLM"脑内运行"的重型评估（Mock客户端没有config，不走此路）
+        local = None
+        if getattr(self.llm, "config", None) is not None:
+            local = evaluate_code_locally(session.problem, user_input)
+            if local.verdict == "incorrect":
+                session.start_guidance()
+                return self._describe_failed_case(local)
+
         # 调用LLM评估
         prompt = self.prompts.get_code_evaluation_prompt(session, user_input)
-        response = self.llm.call_json(prompt)
-        
-        evaluation = response.get("evaluation", "incorrect")
-        reply = response.get("reply", "")
+        response = LLMResponse.from_json(
+            self._call_json(prompt, draft=True, session=session,
+                            schema=RESPONSE_SCHEMAS["code_eval"])
+        )
+
+        evaluation = response.evaluation
+        reply = response.reply
+
+        # 本地已验证通过时，以本地结论为准
+        if local is not None and local.verdict == "correct":
+            if evaluation != "correct":
+                # LLM判错但全部用例实测通过：其批评性回复不能用，换成确认语
+                reply = "我运行了一下你的代码，所有测试用例都通过了，写得不错！"
+            evaluation = "correct"
         
         if evaluation == "correct":
             # 代码正确，开始追问
@@ -353,14 +894,31 @@ class CoachEngine:
             session.start_guidance()
             return reply
     
+    def _describe_failed_case(self, result) -> str:
+        """把本地判题的失败用例转成引导性回复"""
+        if result.failed_input is not None and result.actual is not None:
+            return (
+                f"我运行了一下你的代码：用例 输入={result.failed_input} "
+                f"的实际输出是 {result.actual}，但期望输出是 {result.expected}。"
+                "你觉得问题可能出在哪里？"
+            )
+        if result.error:
+            return (
+                f"我运行了一下你的代码，执行时报错了：{result.error}。"
+                "你觉得是哪里出了问题？"
+            )
+        return "我运行了一下你的代码，有测试用例没有通过。要不要再检查一下边界情况？"
+
     def _generate_followup_question(self, session: Session) -> str:
         """生成追问问题"""
         q_num = session.followup_state.questions_asked + 1
         
         prompt = self.prompts.get_followup_prompt(session, q_num)
-        response = self.llm.call_json(prompt)
-        
-        question = response.get("question", "你能解释一下你的算法的时间复杂度吗？")
+        response = LLMResponse.from_json(
+            self._call_json(prompt, session=session, schema=RESPONSE_SCHEMAS["followup"])
+        )
+
+        question = response.question or "你能解释一下你的算法的时间复杂度吗？"
         session.followup_state.add_question(question)
         
         return question
@@ -368,8 +926,13 @@ class CoachEngine:
     def _generate_teaching(self, session: Session) -> str:
         """生成教学内容（5次尝试后）"""
         prompt = self.prompts.get_teaching_prompt(session)
-        response = self.llm.call(prompt)  # 教学内容不需要JSON格式
-        return response
+        # 教学prompt是最大的一条；接真实provider时同样把开头的稳定
+        # 前缀拆成system prompt发送，让provider端前缀缓存接住这段prefill
+        if getattr(self.llm, "config", None) is not None and session.problem is not None:
+            prompt, system_prompt = self._split_static_prefix(prompt, session.problem)
+            if system_prompt is not None:
+                return self.llm.call(prompt, system_prompt=system_prompt)
+        return self.llm.call(prompt)  # 教学内容不需要JSON格式
     
     def _generate_completion(self, session: Session) -> str:
         """生成完成总结"""
@@ -384,12 +947,14 @@ class CoachEngine:
     def _handle_help_request(self, session: Session, user_input: str) -> str:
         """处理用户的帮助请求"""
         prompt = self.prompts.get_help_request_prompt(session, user_input)
-        response = self.llm.call_json(prompt)
-        
+        response = LLMResponse.from_json(
+            self._call_json(prompt, session=session, schema=RESPONSE_SCHEMAS["help"])
+        )
+
         # 增加尝试次数
         session.guidance_state.increment_attempt()
-        
-        return response.get("reply", "让我们一步步来。首先，你对这道题的第一反应是什么？")
+
+        return response.reply or "让我们一步步来。首先，你对这道题的第一反应是什么？"
     
     def _handle_skip(self, session: Session) -> str:
         """处理跳过请求"""
@@ -0,0 +1,202 @@
+"""本地判题（确定性快路径）
+
+让LLM"脑内运行"测试用例既不可靠又耗token。对于测试用例可以
+程序化执行的题目，先在子进程沙箱里真正跑一遍用户代码：
+本地执行只要几毫秒、零token，结果确定时可以跳过或佐证LLM评估。
+
+判定保守：只有在能明确解析输入、找到入口函数、且所有用例都能
+正常调用时才给出 correct/incorrect；任何结构性不匹配（比如题目
+用链表而输入是list字面量）都返回 ambiguous，交回LLM评估。
+"""
+
+import ast
+import json
+import logging
+import subprocess
+import sys
+from dataclasses import dataclass
+from typing import Optional
+
+from src.models import Problem
+
+logger = logging.getLogger(__name__)
+
+# 子进程整体超时（秒），CPU时间和内存在子进程内用rlimit再限一层
+EVAL_TIMEOUT = 2.0
+
+# 在子进程中执行的判题脚本：从stdin读{code, test_cases}，
+# 逐用例调用用户代码，把结论以JSON写到stdout
+_RUNNER_SCRIPT = r'''
+import ast, json, sys
+
+try:
+    import resource
+    resource.setrlimit(resource.RLIMIT_CPU, (2, 2))
+    resource.setrlimit(resource.RLIMIT_AS, (512 * 1024 * 1024,) * 2)
+except Exception:
+    pass
+
+
+def _parse_expected(raw):
+    try:
+        return json.loads(raw)
+    except (ValueError, TypeError):
+        try:
+            return ast.literal_eval(raw)
+        except (ValueError, SyntaxError):
+            return raw
+
+
+def _normalize(value):
+    if isinstance(value, tuple):
+        return list(value)
+    return value
+
+
+def main():
+    payload = json.load(sys.stdin)
+    namespace = {}
+    try:
+        exec(payload["code"], namespace)
+    except Exception as e:
+        print(json.dumps({"verdict": "incorrect", "error": f"{type(e).__name__}: {e}"}))
+        return
+
+    func = namespace.get(payload["entry"])
+    if not callable(func):
+        print(json.dumps({"verdict": "ambiguous"}))
+        return
+
+    for case in payload["test_cases"]:
+        try:
+            kwargs = eval(f"dict({case['input']})", {"__builtins__": {}, "dict": dict})
+        except Exception:
+            print(json.dumps({"verdict": "ambiguous"}))
+            return
+
+        try:
+            actual = func(**kwargs)
+        except (TypeError, AttributeError, NotImplementedError):
+            # 签名/数据结构对不上（如链表题的list输入），无法本地判定
+            print(json.dumps({"verdict": "ambiguous"}))
+            return
+        except Exception as e:
+            print(json.dumps({
+                "verdict": "incorrect",
+                "failed_input": case["input"],
+                "error": f"{type(e).__name__}: {e}",
+            }))
+            return
+
+        expected = _parse_expected(case.get("output"))
+        if _normalize(actual) != expected:
+            print(json.dumps({
+                "verdict": "incorrect",
+                "failed_input": case["input"],
+                "expected": case.get("output"),
+                "actual": repr(actual),
+            }))
+            return
+
+    print(json.dumps({"verdict": "correct"}))
+
+
+main()
+'''
+
+
+@dataclass(slots=True)
+class LocalEvalResult:
+    """本地判题结论"""
+    verdict: str                             # correct / incorrect / ambiguous
+    failed_input: Optional[str] = None       # 未通过的用例输入
+    expected: Optional[str] = None           # 期望输出
+    actual: Optional[str] = None             # 实际输出
+    error: Optional[str] = None              # 运行时错误信息
+
+
+_AMBIGUOUS = LocalEvalResult(verdict="ambiguous")
+
+
+def _case_param_names(test_input: str) -> Optional[frozenset]:
+    """从用例输入（如 "nums = [...], target = 9"）解析参数名集合"""
+    try:
+        call = ast.parse(f"dict({test_input})", mode="eval").body
+    except SyntaxError:
+        return None
+    if not isinstance(call, ast.Call) or call.args:
+        return None
+    names = [kw.arg for kw in call.keywords]
+    if not names or None in names:
+        return None
+    return frozenset(names)
+
+
+def _find_entry_function(code: str, param_names: frozenset) -> Optional[str]:
+    """找用户代码的入口函数名
+
+    取参数名覆盖用例参数的最后一个顶层def——代码里常有辅助函数
+    （helper、check等）排在解法后面，只看"最后一个def"会选错入口，
+    把正确解法误判成错误。没有任何def匹配时返回None，交回LLM。
+    """
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return None
+    entry = None
+    for node in tree.body:
+        if isinstance(node, ast.FunctionDef):
+            args = node.args
+            accepted = {a.arg for a in args.posonlyargs + args.args + args.kwonlyargs}
+            if param_names <= accepted:
+                entry = node.name
+    return entry
+
+
+def evaluate_code_locally(problem: Problem, code: str,
+                          timeout: float = EVAL_TIMEOUT) -> LocalEvalResult:
+    """在子进程沙箱里用题目的测试用例运行用户代码
+
+    返回的verdict为correct/incorrect时结论是确定的；
+    ambiguous表示无法本地判定，调用方应回退到LLM评估。
+    """
+    if not problem or not problem.test_cases:
+        return _AMBIGUOUS
+
+    param_names = _case_param_names(problem.test_cases[0].get("input", ""))
+    if param_names is None:
+        # 输入不是 name=value 形式，无法可靠匹配入口函数
+        return _AMBIGUOUS
+
+    entry = _find_entry_function(code, param_names)
+    if entry is None:
+        # 没有参数匹配的顶层函数（语法错误、脚本式代码或签名不符），交给LLM
+        return _AMBIGUOUS
+
+    payload = json.dumps({
+        "code": code,
+        "entry": entry,
+        "test_cases": problem.test_cases,
+    }, ensure_ascii=False)
+
+    try:
+        proc = subprocess.run(
+            [sys.executable, "-I", "-c", _RUNNER_SCRIPT],
+            input=payload, capture_output=True, text=True, timeout=timeout
+        )
+        result = json.loads(proc.stdout)
+    except subprocess.TimeoutExpired:
+        # 超时大概率是死循环，但也可能只是机器慢，保守处理
+        logger.debug("Local evaluation timed out")
+        return _AMBIGUOUS
+    except Exception as e:
+        logger.debug("Local evaluation failed: %s", e)
+        return _AMBIGUOUS
+
+    return LocalEvalResult(
+        verdict=result.get("verdict", "ambiguous"),
+        failed_input=result.get("failed_input"),
+        expected=result.get("expected"),
+        actual=result.get("actual"),
+        error=result.get("error"),
+    )
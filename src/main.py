@@ -14,20 +14,53 @@
 """
 
 import argparse
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import sys
 import os
 from typing import Optional
 
-from src.models import Session
-from src.coach_engine import CoachEngine, get_coach_engine
+from src.models import Session, SessionPhase
+from src.coach_engine import CoachEngine, get_coach_engine, match_quick_intent
 from src.problem_library import get_problem_library, Problem
 from src.llm_client import (
     create_llm_client, 
     set_llm_client,
     MockLLMClient,
-    LLMConfig
+    LLMConfig,
+    DEFAULT_MODEL_BY_PHASE
 )
 
+# 可选：prompt_toolkit提供真正的异步输入行——读取期间事件循环
+# 继续运转（后台预取、流式渲染都不被stdin阻塞）。未安装时
+# 回退到线程池里的内建input()
+try:
+    from prompt_toolkit import PromptSession
+    from prompt_toolkit.patch_stdout import patch_stdout
+except ImportError:
+    PromptSession = None
+
+
+# 阶段显示名/提示符图标（模块加载时构建一次，CLI循环每次迭代直接查表；
+# 以IntEnum成员为key，查表是整数哈希）
+_PHASE_NAMES = {
+    SessionPhase.WAITING_PROBLEM: "等待选题",
+    SessionPhase.WAITING_CODE: "等待代码",
+    SessionPhase.GUIDING: "引导中",
+    SessionPhase.FOLLOWUP: "追问中",
+    SessionPhase.TEACHING: "教学中",
+    SessionPhase.COMPLETED: "已完成"
+}
+
+_PHASE_ICONS = {
+    SessionPhase.WAITING_CODE: "💻",
+    SessionPhase.GUIDING: "🎯",
+    SessionPhase.FOLLOWUP: "❓",
+    SessionPhase.TEACHING: "📖",
+    SessionPhase.COMPLETED: "✅"
+}
+
 
 class InterviewCoachApp:
     """
@@ -48,24 +81,43 @@ class InterviewCoachApp:
             api_key: API密钥（可选，也可通过环境变量设置）
             model: 模型名称（可选）
         """
-        # 配置LLM
-        if provider == "mock":
-            set_llm_client(MockLLMClient())
-            print("✓ 使用Mock LLM（开发模式）")
-        else:
-            try:
-                config = self._build_llm_config(provider, api_key, model)
-                client = create_llm_client(provider, config)
-                set_llm_client(client)
-                print(f"✓ 使用 {provider} LLM (模型: {config.model})")
-            except Exception as e:
-                print(f"⚠ 无法连接 {provider}，使用Mock模式: {e}")
-                set_llm_client(MockLLMClient())
-        
-        self.engine = get_coach_engine()
-        self.problem_library = get_problem_library()
+        # 并行预加载：客户端构建（可能含网络校验）、题库加载和
+        # 引擎初始化互不依赖，启动耗时从三者之和降为最大值
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            future_client = (
+                executor.submit(self._create_client, provider, api_key, model)
+                if provider != "mock" else None
+            )
+            future_engine = executor.submit(get_coach_engine)
+            future_library = executor.submit(get_problem_library)
+
+            if future_client is None:
+                client = MockLLMClient()
+                print("✓ 使用Mock LLM（开发模式）")
+            else:
+                try:
+                    client = future_client.result()
+                except Exception as e:
+                    print(f"⚠ 无法连接 {provider}，使用Mock模式: {e}")
+                    client = MockLLMClient()
+            set_llm_client(client)
+
+            self.engine = future_engine.result()
+            self.problem_library = future_library.result()
+
+        # 后台预热连接（DNS/TLS/连接池），首个真实轮次不付建连成本
+        threading.Thread(target=client.warmup, daemon=True).start()
         self.current_session: Optional[Session] = None
+        # 投机预取任务：用户打字时后台预生成提示回复
+        self._hint_task: Optional[asyncio.Task] = None
     
+    def _create_client(self, provider: str, api_key: str = None, model: str = None):
+        """构建真实provider客户端（在预加载线程池中执行）"""
+        config = self._build_llm_config(provider, api_key, model)
+        client = create_llm_client(provider, config)
+        print(f"✓ 使用 {provider} LLM (模型: {config.model})")
+        return client
+
     def _build_llm_config(self, provider: str, api_key: str = None, model: str = None) -> LLMConfig:
         """构建LLM配置"""
         # 默认模型
@@ -79,7 +131,9 @@ class InterviewCoachApp:
             model=model or default_models.get(provider, "qwen-plus"),
             api_key=api_key,
             temperature=0.7,
-            max_tokens=2000
+            max_tokens=2000,
+            # 未显式指定模型时按阶段降档（教学用大模型，回显类用小模型）
+            model_by_phase=DEFAULT_MODEL_BY_PHASE if (provider == "qwen" and not model) else None
         )
     
     def start_session(self, problem: Problem = None) -> str:
@@ -101,6 +155,20 @@ class InterviewCoachApp:
             self.current_session.session_id,
             message
         )
+
+    def send_message_stream(self, message: str):
+        """发送消息（流式），逐段产出回复
+
+        CLI等上层可以边接收边渲染，首段到达即可开始输出。
+        """
+        if not self.current_session:
+            yield "请先开始一个会话。"
+            return
+
+        yield from self.engine.process_input_stream(
+            self.current_session.session_id,
+            message
+        )
     
     def get_status(self) -> dict:
         """获取当前状态"""
@@ -110,7 +178,7 @@ class InterviewCoachApp:
         session = self.current_session
         return {
             "session_id": session.session_id,
-            "phase": session.phase.value,
+            "phase": session.phase.name.lower(),
             "problem": session.problem.title if session.problem else None,
             "guidance_attempts": session.guidance_state.attempt_count,
             "followup_progress": f"{session.followup_state.questions_asked}/{session.followup_state.total_questions}"
@@ -118,13 +186,31 @@ class InterviewCoachApp:
     
     def run_cli(self):
         """运行CLI交互"""
+        asyncio.run(self._run_cli_async())
+
+    async def _run_cli_async(self):
+        """异步CLI主循环
+
+        stdin读取放线程池，引擎调用放工作线程，事件循环保持空转，
+        这样用户打字的几秒钟可以用来投机预取下一个提示回复——
+        LLM延迟被隐藏在人类输入时间之后。
+        """
         self._print_welcome()
-        
+
+        loop = asyncio.get_running_loop()
+        prompt_session = PromptSession() if PromptSession is not None else None
+
         while True:
             try:
-                # 显示提示符
+                # 显示提示符并读取输入：优先prompt_toolkit的异步读取
+                #（事件循环不被stdin阻塞，后台打印不破坏编辑行），
+                # 未安装时把阻塞的input()放进线程池
                 prompt = self._get_prompt()
-                user_input = input(prompt).strip()
+                if prompt_session is not None:
+                    with patch_stdout():
+                        user_input = (await prompt_session.prompt_async(prompt)).strip()
+                else:
+                    user_input = (await loop.run_in_executor(None, input, prompt)).strip()
                 
                 if not user_input:
                     continue
@@ -160,15 +246,79 @@ class InterviewCoachApp:
                     print("\n请先选择一道题目。输入 'problems' 查看题目列表，或 'new' 开始随机题目。")
                     continue
                 
-                response = self.send_message(user_input)
-                print(f"\n{response}\n")
+                reply = await self._respond(user_input)
+                if reply is not None:
+                    print(f"\n{reply}\n")
+
+                self._start_hint_prefetch()
                 
             except KeyboardInterrupt:
                 print("\n\n再见！")
                 break
             except Exception as e:
                 print(f"\n出错了: {e}")
-    
+
+        self._cancel_hint_prefetch()
+
+    async def _respond(self, user_input: str) -> Optional[str]:
+        """生成本轮回复，能用预取结果时直接使用
+
+        预取命中时返回完整回复交给主循环打印；常规路径走流式
+        渲染（边接收边输出），已自行打印，返回None。
+        """
+        prefetched = await self._take_prefetched_hint(user_input)
+        if prefetched is not None:
+            reply = self.engine.consume_prefetched_help(
+                self.current_session.session_id, user_input, prefetched
+            )
+            if reply is not None:
+                return reply
+
+        # 引擎调用放工作线程，预取任务可并行推进
+        await asyncio.to_thread(self._render_stream, user_input)
+        return None
+
+    def _render_stream(self, user_input: str) -> None:
+        """流式渲染回复：首段到达即开始输出，不等整轮生成完"""
+        print()
+        for chunk in self.send_message_stream(user_input):
+            print(chunk, end="", flush=True)
+        print("\n")
+
+    def _start_hint_prefetch(self):
+        """在等待用户输入期间后台预取提示回复"""
+        self._cancel_hint_prefetch()
+        session = self.current_session
+        if session is None or session.phase not in (SessionPhase.WAITING_CODE, SessionPhase.GUIDING):
+            return
+        self._hint_task = asyncio.create_task(
+            asyncio.to_thread(self.engine.prefetch_help_reply, session.session_id)
+        )
+        # 顺带把下一轮候选prompt的前缀写入provider端缓存（Mock下为空操作）
+        threading.Thread(
+            target=self.engine.warm_prompt_cache, args=(session.session_id,),
+            daemon=True,
+        ).start()
+
+    async def _take_prefetched_hint(self, user_input: str) -> Optional[str]:
+        """用户确实在请求帮助且预取已完成时，取走预取结果"""
+        task, self._hint_task = self._hint_task, None
+        if task is None:
+            return None
+        if match_quick_intent(user_input) != "ask_for_help":
+            task.cancel()
+            return None
+        try:
+            return await task
+        except Exception:
+            return None
+
+    def _cancel_hint_prefetch(self):
+        """取消挂起的预取任务"""
+        if self._hint_task is not None:
+            self._hint_task.cancel()
+            self._hint_task = None
+
     def _print_welcome(self):
         """打印欢迎信息"""
         print("""
@@ -220,20 +370,11 @@ class InterviewCoachApp:
             print("\n⚪ 当前没有进行中的会话")
             return
         
-        phase_names = {
-            "waiting_problem": "等待选题",
-            "waiting_code": "等待代码",
-            "guiding": "引导中",
-            "followup": "追问中",
-            "teaching": "教学中",
-            "completed": "已完成"
-        }
-        
         print(f"""
 📊 当前状态
 ─────────────────────────
 题目：{status['problem'] or '未选择'}
-阶段：{phase_names.get(status['phase'], status['phase'])}
+阶段：{_PHASE_NAMES.get(self.current_session.phase, status['phase'])}
 引导尝试：{status['guidance_attempts']}/5
 追问进度：{status['followup_progress']}
 ─────────────────────────
@@ -275,15 +416,8 @@ class InterviewCoachApp:
         if not self.current_session:
             return ">>> "
         
-        phase = self.current_session.phase.value
-        phase_icons = {
-            "waiting_code": "💻",
-            "guiding": "🎯",
-            "followup": "❓",
-            "teaching": "📖",
-            "completed": "✅"
-        }
-        icon = phase_icons.get(phase, "🤖")
+        phase = self.current_session.phase
+        icon = _PHASE_ICONS.get(phase, "🤖")
         return f"{icon} >>> "
 
 
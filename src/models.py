@@ -8,52 +8,99 @@
 - 追踪引导尝试次数
 """
 
-from enum import Enum
+import itertools
+import os
+import time
+from collections import deque
+from enum import Enum, IntEnum
 from dataclasses import dataclass, field
-from typing import Dict, List, Optional, Any
+from itertools import islice
+from typing import Deque, Dict, List, Optional, Any
 from datetime import datetime
 import json
 
+# 单个会话在内存中保留的最大消息数（deque自动淘汰最旧的）
+MAX_SESSION_MESSAGES = 200
 
-class SessionPhase(Enum):
+# 构建LLM上下文时对话历史的默认token预算
+HISTORY_TOKEN_BUDGET = 1500
+
+# get_conversation_history默认返回的最近消息条数
+# （增量序列化缓存按此容量维护）
+RECENT_HISTORY_N = 10
+
+# 可选：tiktoken精确计数；未安装时用字符数估算
+_ENCODING = None
+try:
+    import tiktoken
+    _ENCODING = tiktoken.get_encoding("cl100k_base")
+except ImportError:
+    pass
+
+
+def _estimate_tokens(text: str) -> int:
+    """估算文本token数
+
+    有tiktoken时精确编码；否则按约2字符/token估算
+    （中文约1字符/token、英文约4字符/token的折中）。
+    """
+    if _ENCODING is not None:
+        return len(_ENCODING.encode(text))
+    return max(1, len(text) // 2)
+
+
+class SessionPhase(IntEnum):
     """
     会话阶段 - 内部使用，用户不可见
     
-    这些阶段是LLM内部判断的，不会展示给用户
+    这些阶段是LLM内部判断的，不会展示给用户。
+    IntEnum让热路径上的阶段比较是整数比较；序列化时
+    用模块级PHASE_NAMES查表得到稳定的字符串名。
     """
-    WAITING_PROBLEM = "waiting_problem"      # 等待用户提供题目
-    WAITING_CODE = "waiting_code"            # 等待用户提交代码
-    GUIDING = "guiding"                      # 引导中（代码错误或用户请求帮助）
-    FOLLOWUP = "followup"                    # 追问中（代码正确后的3个问题）
-    TEACHING = "teaching"                    # 教学中（5次未答对，给出答案和教学）
-    COMPLETED = "completed"                  # 本题结束
+    WAITING_PROBLEM = 0                      # 等待用户提供题目
+    WAITING_CODE = 1                         # 等待用户提交代码
+    GUIDING = 2                              # 引导中（代码错误或用户请求帮助）
+    FOLLOWUP = 3                             # 追问中（代码正确后的3个问题）
+    TEACHING = 4                             # 教学中（5次未答对，给出答案和教学）
+    COMPLETED = 5                            # 本题结束
 
 
-class UserIntent(Enum):
+class UserIntent(IntEnum):
     """
     用户意图 - LLM识别
     """
-    SUBMIT_CODE = "submit_code"              # 提交代码
-    ASK_FOR_HELP = "ask_for_help"            # 请求帮助/提示
-    ANSWER_QUESTION = "answer_question"      # 回答引导问题
-    ASK_QUESTION = "ask_question"            # 提问
-    SKIP_PROBLEM = "skip_problem"            # 跳过当前题目
-    OTHER = "other"                          # 其他
+    SUBMIT_CODE = 0                          # 提交代码
+    ASK_FOR_HELP = 1                         # 请求帮助/提示
+    ANSWER_QUESTION = 2                      # 回答引导问题
+    ASK_QUESTION = 3                         # 提问
+    SKIP_PROBLEM = 4                         # 跳过当前题目
+    OTHER = 5                                # 其他
 
 
-class CodeEvaluation(Enum):
+class CodeEvaluation(IntEnum):
     """
     代码评估结果
     """
-    CORRECT = "correct"                      # 正确
-    INCORRECT = "incorrect"                  # 错误
-    PARTIAL = "partial"                      # 部分正确
-    CANNOT_EVALUATE = "cannot_evaluate"      # 无法评估
+    CORRECT = 0                              # 正确
+    INCORRECT = 1                            # 错误
+    PARTIAL = 2                              # 部分正确
+    CANNOT_EVALUATE = 3                      # 无法评估
+
 
+# 各枚举的序列化名：下标即枚举值，to_dict时O(1)查表，
+# 输出与旧的字符串枚举值保持一致
+PHASE_NAMES = tuple(member.name.lower() for member in SessionPhase)
+INTENT_NAMES = tuple(member.name.lower() for member in UserIntent)
+EVALUATION_NAMES = tuple(member.name.lower() for member in CodeEvaluation)
 
-@dataclass
+
+@dataclass(frozen=True, eq=False, slots=True)
 class Problem:
-    """题目信息"""
+    """题目信息
+
+    创建后只读（frozen），实例可安全地作为缓存key按身份哈希；
+    eq=False保留身份比较，避免按含list的字段生成__hash__。
+    """
     title: str
     description: str
     difficulty: str = "medium"               # easy, medium, hard
@@ -61,34 +108,68 @@ class Problem:
     test_cases: List[Dict] = field(default_factory=list)
     solution_hints: List[str] = field(default_factory=list)  # 用于LLM引导
     
+    # to_dict/测试用例渲染结果缓存（题库中的题目创建后不再变化）
+    _cached_dict: Optional[Dict] = field(default=None, init=False, repr=False, compare=False)
+    _cached_test_block: Optional[str] = field(default=None, init=False, repr=False, compare=False)
+
     def to_dict(self) -> Dict:
-        return {
-            "title": self.title,
-            "description": self.description,
-            "difficulty": self.difficulty,
-            "expected_complexity": self.expected_complexity,
-            "test_cases": self.test_cases
-        }
+        if self._cached_dict is None:
+            # frozen实例的缓存写入要绕过__setattr__
+            object.__setattr__(self, "_cached_dict", {
+                "title": self.title,
+                "description": self.description,
+                "difficulty": self.difficulty,
+                "expected_complexity": self.expected_complexity,
+                "test_cases": self.test_cases
+            })
+        return self._cached_dict
 
+    def formatted_test_cases(self) -> str:
+        """测试用例的prompt片段（每道题只格式化一次）
+
+        渲染结果属于题目数据本身，缓存在实例上，
+        所有PromptLibrary实例共享同一份。
+        """
+        if self._cached_test_block is None:
+            if not self.test_cases:
+                block = "（无测试用例）"
+            else:
+                block = "\n".join(
+                    f"用例{i}: 输入={tc.get('input', 'N/A')}, 期望输出={tc.get('output', 'N/A')}"
+                    for i, tc in enumerate(self.test_cases, 1)
+                )
+            object.__setattr__(self, "_cached_test_block", block)
+        return self._cached_test_block
 
-@dataclass
+
+@dataclass(slots=True)
 class Message:
-    """对话消息"""
+    """对话消息
+
+    timestamp存为time.time()浮点数——比构造datetime便宜得多，
+    序列化时才惰性转成ISO格式。
+    """
     role: str                                # "user" or "assistant"
     content: str
-    timestamp: datetime = field(default_factory=datetime.now)
+    timestamp: float = field(default_factory=time.time)
     metadata: Dict = field(default_factory=dict)
+
+    # to_dict结果缓存：历史消息每轮都会重新序列化进上下文，
+    # 消息一旦写入不再变化，字典和ISO时间戳只构造一次
+    _cached_dict: Optional[Dict] = field(default=None, init=False, repr=False, compare=False)
     
     def to_dict(self) -> Dict:
-        return {
-            "role": self.role,
-            "content": self.content,
-            "timestamp": self.timestamp.isoformat(),
-            "metadata": self.metadata
-        }
+        if self._cached_dict is None:
+            self._cached_dict = {
+                "role": self.role,
+                "content": self.content,
+                "timestamp": datetime.fromtimestamp(self.timestamp).isoformat(),
+                "metadata": self.metadata
+            }
+        return self._cached_dict
 
 
-@dataclass
+@dataclass(slots=True)
 class GuidanceState:
     """
     引导状态追踪
@@ -122,7 +203,7 @@ class GuidanceState:
         self.topics_covered = []
 
 
-@dataclass
+@dataclass(slots=True)
 class FollowUpState:
     """
     追问状态追踪
@@ -146,7 +227,25 @@ class FollowUpState:
         self.questions_history = []
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
+class LLMContext:
+    """传给prompt builder的会话上下文快照
+
+    frozen槽位实例：属性读取是C层槽位访问，比dict下标少一次
+    哈希查找；快照创建后只读，可安全地跨builder缓存复用。
+    """
+    problem: Optional[Dict]
+    phase: str
+    user_code: Optional[str]
+    guidance_attempts: int
+    guidance_remaining: int
+    hint_level: int
+    followup_progress: str
+    history_summary: Optional[str]
+    conversation_history: List[Dict]
+
+
+@dataclass(slots=True)
 class Session:
     """
     会话状态 - 核心数据结构
@@ -157,8 +256,10 @@ class Session:
     problem: Optional[Problem] = None
     phase: SessionPhase = SessionPhase.WAITING_PROBLEM
     
-    # 对话历史
-    messages: List[Message] = field(default_factory=list)
+    # 对话历史（有界环形缓冲，防止超长会话无限占用内存）
+    messages: Deque[Message] = field(
+        default_factory=lambda: deque(maxlen=MAX_SESSION_MESSAGES)
+    )
     
     # 用户提交的代码
     user_code: Optional[str] = None
@@ -167,10 +268,34 @@ class Session:
     guidance_state: GuidanceState = field(default_factory=GuidanceState)
     followup_state: FollowUpState = field(default_factory=FollowUpState)
     
-    # 时间戳
-    created_at: datetime = field(default_factory=datetime.now)
-    updated_at: datetime = field(default_factory=datetime.now)
-    
+    # 旧对话的滚动摘要（淡出token预算的消息压缩存档）
+    rolling_summary: str = ""
+    summary_upto_idx: int = 0                # 摘要已覆盖到的消息序号（对应_msg_seq）
+
+    # 时间戳（time.time()浮点数，避免热路径上构造datetime）
+    created_at: float = field(default_factory=time.time)
+    updated_at: float = field(default_factory=time.time)
+
+    # 最近N条消息的序列化缓存：消息只追加不修改，在添加时增量维护，
+    # 每个LLM轮次取历史就是O(1)拷贝而非重新遍历序列化
+    _recent_serialized: Deque[Dict] = field(
+        default_factory=lambda: deque(maxlen=RECENT_HISTORY_N),
+        repr=False, compare=False
+    )
+
+    # 与messages平行的每条消息token估算值（SoA布局）：预算截断时
+    # 对两个紧凑数组做lockstep遍历，不必每轮重新估算全部旧消息
+    _token_costs: Deque[int] = field(
+        default_factory=lambda: deque(maxlen=MAX_SESSION_MESSAGES),
+        repr=False, compare=False
+    )
+
+    # LLM上下文缓存：一轮对话里多个prompt builder会各取一次上下文，
+    # 状态指纹没变时直接复用，摘要/历史的组装每轮最多做一次
+    _msg_seq: int = field(default=0, repr=False, compare=False)
+    _ctx_cache: Optional["LLMContext"] = field(default=None, repr=False, compare=False)
+    _ctx_fingerprint: Optional[tuple] = field(default=None, repr=False, compare=False)
+
     def add_message(self, role: str, content: str, metadata: Dict = None):
         """添加消息到历史"""
         msg = Message(
@@ -179,8 +304,28 @@ class Session:
             metadata=metadata or {}
         )
         self.messages.append(msg)
-        self.updated_at = datetime.now()
+        self._recent_serialized.append(msg.to_dict())
+        self._token_costs.append(_estimate_tokens(content))
+        self._msg_seq += 1
+        self.updated_at = time.time()
     
+    def add_exchange(self, user_content: str, assistant_content: str):
+        """一次性记录一轮问答（用户输入+教练回复）
+
+        相比两次add_message，只更新一次时间戳，
+        若后续接入持久化存储也只需落盘一次。
+        """
+        user_msg = Message(role="user", content=user_content)
+        assistant_msg = Message(role="assistant", content=assistant_content)
+        self.messages.append(user_msg)
+        self.messages.append(assistant_msg)
+        self._recent_serialized.append(user_msg.to_dict())
+        self._recent_serialized.append(assistant_msg.to_dict())
+        self._token_costs.append(_estimate_tokens(user_content))
+        self._token_costs.append(_estimate_tokens(assistant_content))
+        self._msg_seq += 2
+        self.updated_at = time.time()
+
     def get_conversation_history(self, last_n: int = None) -> List[Dict]:
         """
         获取对话历史（用于LLM上下文）
@@ -188,30 +333,75 @@ class Session:
         Args:
             last_n: 只获取最近n条，None表示全部
         """
-        messages = self.messages[-last_n:] if last_n else self.messages
+        # 默认条数直接取增量维护的缓存，不重新遍历
+        if last_n == RECENT_HISTORY_N:
+            return list(self._recent_serialized)
+        if last_n and last_n < len(self.messages):
+            messages = islice(self.messages, len(self.messages) - last_n, None)
+        else:
+            messages = self.messages
         return [msg.to_dict() for msg in messages]
     
-    def get_context_for_llm(self) -> Dict:
+    def get_budgeted_history(self, token_budget: int = HISTORY_TOKEN_BUDGET) -> List[Dict]:
+        """按token预算收集对话历史（从最新往旧，超出预算即停）
+
+        prefill成本与上下文长度成正比；固定条数的历史在消息含长代码
+        时会带上几千token。按预算截断可把prefill长度控制住，
+        最新一条消息始终保留。
+        """
+        selected = []
+        used = 0
+        # token成本存在与messages平行的数组里，入列时算好，
+        # 这里只做两个数组的lockstep遍历
+        for msg, cost in zip(reversed(self.messages), reversed(self._token_costs)):
+            if selected and used + cost > token_budget:
+                break
+            selected.append(msg.to_dict())
+            used += cost
+        selected.reverse()
+        return selected
+
+    def _context_fingerprint(self) -> tuple:
+        """上下文依赖的全部可变状态的轻量指纹"""
+        gs = self.guidance_state
+        fs = self.followup_state
+        return (
+            self._msg_seq, self.phase, self.user_code,
+            gs.attempt_count, gs.max_attempts, gs.current_hint_level,
+            fs.questions_asked, fs.total_questions,
+            self.summary_upto_idx, len(self.rolling_summary),
+        )
+
+    def get_context_for_llm(self) -> "LLMContext":
         """
         获取LLM需要的上下文信息
-        
+
         这个上下文会帮助LLM做出正确判断
         """
-        return {
-            "problem": self.problem.to_dict() if self.problem else None,
-            "phase": self.phase.value,
-            "user_code": self.user_code,
-            "guidance_attempts": self.guidance_state.attempt_count,
-            "guidance_remaining": self.guidance_state.max_attempts - self.guidance_state.attempt_count,
-            "hint_level": self.guidance_state.current_hint_level,
-            "followup_progress": f"{self.followup_state.questions_asked}/{self.followup_state.total_questions}",
-            "conversation_history": self.get_conversation_history(last_n=10)
-        }
-    
+        # 指纹未变时复用上次组装的上下文（同一轮内多个builder共享）
+        fingerprint = self._context_fingerprint()
+        if fingerprint == self._ctx_fingerprint:
+            return self._ctx_cache
+        context = LLMContext(
+            problem=self.problem.to_dict() if self.problem else None,
+            phase=PHASE_NAMES[self.phase],
+            user_code=self.user_code,
+            guidance_attempts=self.guidance_state.attempt_count,
+            guidance_remaining=self.guidance_state.max_attempts - self.guidance_state.attempt_count,
+            hint_level=self.guidance_state.current_hint_level,
+            followup_progress=f"{self.followup_state.questions_asked}/{self.followup_state.total_questions}",
+            history_summary=self.rolling_summary or None,
+            conversation_history=self.get_budgeted_history()
+        )
+        self._ctx_cache = context
+        self._ctx_fingerprint = fingerprint
+        return context
+
+
     def transition_to(self, new_phase: SessionPhase):
         """状态转换"""
         self.phase = new_phase
-        self.updated_at = datetime.now()
+        self.updated_at = time.time()
     
     def start_guidance(self):
         """开始引导流程"""
@@ -241,31 +431,60 @@ class Session:
         # 不清空消息历史，保持对话连续性
 
 
-@dataclass 
+@dataclass(slots=True)
 class LLMResponse:
     """
     LLM响应的结构化表示
     """
     # 给用户的回复内容
-    reply: str
-    
+    reply: str = ""
+
+    # LLM返回的原始判断字段（一次解析，各处理器直接读属性）
+    intent: str = "other"
+    evaluation: str = "incorrect"
+    user_on_right_track: bool = False
+    question: str = ""
+    next_question: str = ""
+
     # 内部判断结果
     detected_intent: Optional[UserIntent] = None
     code_evaluation: Optional[CodeEvaluation] = None
     should_transition: bool = False
     next_phase: Optional[SessionPhase] = None
-    
+
     # 元数据
     reasoning: Optional[str] = None          # LLM的推理过程（调试用）
     confidence: float = 1.0
+
+    @staticmethod
+    def _parse_confidence(value) -> float:
+        try:
+            return float(value)
+        except (ValueError, TypeError):
+            # provider未走schema时confidence可能是"high"之类的字符串
+            return 1.0
+
+    @classmethod
+    def from_json(cls, data: Dict) -> "LLMResponse":
+        """从LLM返回的JSON字典构建，字段提取和默认值处理只做一次"""
+        return cls(
+            reply=data.get("reply", ""),
+            intent=data.get("intent", "other"),
+            evaluation=data.get("evaluation", "incorrect"),
+            user_on_right_track=bool(data.get("user_on_right_track", False)),
+            question=data.get("question", ""),
+            next_question=data.get("next_question", ""),
+            reasoning=data.get("reasoning"),
+            confidence=cls._parse_confidence(data.get("confidence", 1.0))
+        )
     
     def to_dict(self) -> Dict:
         return {
             "reply": self.reply,
-            "detected_intent": self.detected_intent.value if self.detected_intent else None,
-            "code_evaluation": self.code_evaluation.value if self.code_evaluation else None,
+            "detected_intent": INTENT_NAMES[self.detected_intent] if self.detected_intent is not None else None,
+            "code_evaluation": EVALUATION_NAMES[self.code_evaluation] if self.code_evaluation is not None else None,
             "should_transition": self.should_transition,
-            "next_phase": self.next_phase.value if self.next_phase else None,
+            "next_phase": PHASE_NAMES[self.next_phase] if self.next_phase is not None else None,
             "reasoning": self.reasoning,
             "confidence": self.confidence
         }
@@ -273,12 +492,26 @@ class LLMResponse:
 
 # ==================== 工具函数 ====================
 
-def create_session(session_id: str = None) -> Session:
-    """创建新会话"""
-    import uuid
-    return Session(
-        session_id=session_id or str(uuid.uuid4())
-    )
+# 会话ID：进程id+启动时间做前缀，进程内单调计数器保证唯一，
+# 不走uuid4每次分配的getrandom()系统调用
+_SESSION_COUNTER = itertools.count()
+_SID_PREFIX = f"{os.getpid():x}-{int(time.time()):x}-"
+
+
+def create_session(session_id: str = None, secure: bool = False) -> Session:
+    """创建新会话
+
+    Args:
+        session_id: 显式指定的会话ID
+        secure: True时用uuid4生成（需要跨主机的抗碰撞性时使用）
+    """
+    if session_id is None:
+        if secure:
+            import uuid
+            session_id = str(uuid.uuid4())
+        else:
+            session_id = _SID_PREFIX + format(next(_SESSION_COUNTER), "x")
+    return Session(session_id=session_id)
 
 
 def create_problem(
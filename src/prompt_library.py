@@ -8,27 +8,15 @@ Prompt库 (V2 - 对话式引导版本)
 4. 支持动态调整引导策略
 """
 
+from collections import OrderedDict
 from typing import Dict, List, Optional
-from src.models import Session, SessionPhase, Problem
+from src.models import Session, SessionPhase, Problem, LLMContext
 
 
-class PromptLibrary:
-    """
-    Prompt生成库
-    
-    职责：
-    1. 生成系统指令
-    2. 构建各场景的prompt
-    3. 确保LLM不直接给答案
-    """
-    
-    def __init__(self):
-        self.system_instruction = self._build_system_instruction()
-        self.safety_rules = self._build_safety_rules()
-    
-    def _build_system_instruction(self) -> str:
-        """核心系统指令"""
-        return """你是一位经验丰富的算法面试教练。你的角色是通过对话帮助用户提升算法能力。
+# ==================== 全局静态指令（模块常量） ====================
+# 固定不变的指令文本在导入时构建一次，不在每次建库/建prompt时重新拼
+
+_SYSTEM_INSTRUCTION = """你是一位经验丰富的算法面试教练。你的角色是通过对话帮助用户提升算法能力。
 
 【核心原则】
 1. 苏格拉底式教学：通过提问引导用户发现答案，而非直接告知
@@ -42,9 +30,7 @@ class PromptLibrary:
 - 根据用户回答灵活调整方向
 - 用户卡住时提供适当提示，但不能直接给答案"""
 
-    def _build_safety_rules(self) -> str:
-        """安全规则 - 防止LLM给出答案"""
-        return """【绝对禁止 - 必须遵守】
+_SAFETY_RULES = """【绝对禁止】
 ❌ 不要给出完整代码
 ❌ 不要说"答案是..."或"正确解法是..."
 ❌ 不要列出完整的解题步骤 1,2,3
@@ -58,76 +44,133 @@ class PromptLibrary:
 ✓ 用类比解释概念
 ✓ 指出思路中的问题（但不给修正代码）"""
 
-    # ==================== 意图识别 ====================
-    
-    def get_intent_recognition_prompt(self, session: Session, user_input: str) -> str:
-        """
-        生成意图识别Prompt
-        
-        让LLM判断用户意图，同时生成自然的回复
-        """
-        context = session.get_context_for_llm()
-        
-        return f"""{self.system_instruction}
+# 提示强度 -> 说明文本（导入时建一次，不在每次调用里重建dict字面量）
+_HINT_INSTRUCTIONS: Dict[int, str] = {
+    1: '''【Level 1 轻度提示】
+- 只问引导性问题
+- 不给任何具体方向
+- 例如："你觉得这个问题的核心难点是什么？"''',
 
-{self.safety_rules}
+    2: '''【Level 2 中度提示】
+- 可以暗示思考方向
+- 可以提及相关的数据结构或算法类型（但不说具体用法）
+- 例如："有没有什么数据结构可以帮助快速查找？"''',
 
-【当前状态】
-- 会话阶段: {context['phase']}
-- 题目: {context['problem']['title'] if context['problem'] else '未设置'}
-- 引导尝试次数: {context['guidance_attempts']}/{context['guidance_remaining'] + context['guidance_attempts']}
-- 追问进度: {context['followup_progress']}
+    3: '''【Level 3 重度提示】
+- 可以更明确地指出方向
+- 可以用类比解释
+- 但仍然不能给出代码
+- 例如："这道题的关键是用空间换时间，哈希表可以帮助你在O(1)时间内查找...你能想到怎么用吗？"'''
+}
+
+
+# 各场景JSON响应的结构schema：支持结构化输出的provider
+# （OpenAI json_schema / Anthropic tool-use）用它强制返回形状，
+# 彻底消除解析失败重试；prompt里的内联JSON说明保留，作为
+# 不支持schema的路径（DashScope等）的兜底约定
+RESPONSE_SCHEMAS: Dict[str, Dict] = {
+    "intent": {
+        "type": "object",
+        "properties": {
+            "intent": {
+                "type": "string",
+                "enum": ["submit_code", "ask_for_help", "answer_question",
+                         "ask_question", "skip_problem", "other"],
+            },
+            "reply": {"type": "string"},
+            "reasoning": {"type": "string"},
+            "confidence": {"type": "number", "minimum": 0, "maximum": 1},
+        },
+        "required": ["intent", "reply", "confidence"],
+    },
+    "code_eval": {
+        "type": "object",
+        "properties": {
+            "evaluation": {"type": "string", "enum": ["correct", "incorrect", "partial"]},
+            "reply": {"type": "string"},
+            "issues": {"type": "array", "items": {"type": "string"}},
+            "test_result": {"type": "string"},
+            "confidence": {"type": "number", "minimum": 0, "maximum": 1},
+        },
+        "required": ["evaluation", "reply", "confidence"],
+    },
+    "guidance": {
+        "type": "object",
+        "properties": {
+            "user_on_right_track": {"type": "boolean"},
+            "user_current_understanding": {"type": "string"},
+            "what_user_is_missing": {"type": "string"},
+            "reply": {"type": "string"},
+            "hint_used": {"type": "string"},
+        },
+        "required": ["user_on_right_track", "reply"],
+    },
+    "followup": {
+        "type": "object",
+        "properties": {
+            "question": {"type": "string"},
+            "expected_direction": {"type": "string"},
+            "difficulty": {"type": "string", "enum": ["easy", "medium", "hard"]},
+        },
+        "required": ["question"],
+    },
+    "followup_eval": {
+        "type": "object",
+        "properties": {
+            "answer_quality": {"type": "string", "enum": ["good", "partial", "incorrect"]},
+            "correct_answer": {"type": "string"},
+            "user_understanding": {"type": "string"},
+            "reply": {"type": "string"},
+            "next_question": {"type": "string"},
+        },
+        "required": ["answer_quality", "reply"],
+    },
+    "help": {
+        "type": "object",
+        "properties": {
+            "reply": {"type": "string"},
+            "hint_type": {"type": "string"},
+        },
+        "required": ["reply"],
+    },
+}
 
-【最近对话】
-{self._format_conversation(context['conversation_history'])}
 
-【用户输入】
-{user_input}
+class PromptLibrary:
+    """
+    Prompt生成库
+
+    职责：
+    1. 生成系统指令
+    2. 构建各场景的prompt
+    3. 确保LLM不直接给答案
+    """
+
+    # 组装好的完整prompt的LRU缓存容量
+    PROMPT_CACHE_SIZE = 256
+
+    # ==================== 各场景的静态任务说明（类常量） ====================
+    # 任务说明、评估标准、JSON格式要求在所有会话间逐字节不变，
+    # 提前到易变内容（代码、计数器、对话）之前，让可缓存前缀从
+    # 系统指令+题目一路延伸到任务说明，只有真正会变的部分留在末尾
 
-【你的任务】
+    _INTENT_RUBRIC = """【任务】
 1. 理解用户意图
 2. 生成自然的对话回复
 
 请以JSON格式返回：
-{{
+{
     "intent": "submit_code/ask_for_help/answer_question/ask_question/skip_problem/other",
     "reply": "你的自然对话回复",
-    "reasoning": "简短的判断理由"
-}}
-
-注意：reply必须是自然的对话，不要有机器人感觉。"""
-
-    # ==================== 代码评估 ====================
-    
-    def get_code_evaluation_prompt(self, session: Session, code: str) -> str:
-        """
-        生成代码评估Prompt
-        
-        评估用户代码是否正确，并生成相应回复
-        """
-        problem = session.problem
-        
-        return f"""{self.system_instruction}
-
-{self.safety_rules}
-
-【题目】
-{problem.title}
-
-{problem.description}
-
-【期望复杂度】
-{problem.expected_complexity or '未指定'}
+    "reasoning": "简短的判断理由",
+    "confidence": 0到1的小数，表示你对intent判断的把握
+}
 
-【测试用例】
-{self._format_test_cases(problem.test_cases)}
+注意：reply必须是自然的对话，不要有机器人感觉。
+当intent为ask_for_help时，reply本身就应是符合当前提示强度的引导性提示
+（只引导、不给答案），不要只回复"好的，我来帮你"之类的过渡语。"""
 
-【用户提交的代码】
-```
-{code}
-```
-
-【你的任务 - 严格评估代码】
+    _CODE_EVAL_RUBRIC = """【任务】严格评估代码。
 
 请仔细分析用户的代码，检查以下方面：
 1. **逻辑正确性**：代码逻辑是否能正确解决问题？
@@ -135,7 +178,7 @@ class PromptLibrary:
 3. **测试用例**：用给定的测试用例在脑中运行代码，结果是否正确？
 4. **复杂度**：时间/空间复杂度是否符合要求？
 
-【评估标准 - 必须严格遵守】
+【评估标准】
 - "correct"：代码完全正确，能通过所有测试用例，逻辑无误
 - "incorrect"：代码有明显错误、逻辑漏洞、或无法通过测试用例
 - "partial"：思路正确但实现有小问题
@@ -147,74 +190,30 @@ class PromptLibrary:
 - 宁可判断为 incorrect 也不要误判为 correct
 
 请以JSON格式返回：
-{{
+{
     "evaluation": "correct/incorrect/partial",
     "reply": "你的回复",
     "issues": ["具体问题1", "具体问题2"],
-    "test_result": "用第一个测试用例验证的结果说明"
-}}
+    "test_result": "用第一个测试用例验证的结果说明",
+    "confidence": 0到1的小数，表示你对evaluation判断的把握
+}
 
 回复要求：
 - 如果代码正确(correct)：简短肯定，然后问一个追问问题
 - 如果代码错误(incorrect)：用引导性问题帮助用户发现问题，不要直接说出答案
 - 如果部分正确(partial)：肯定正确的部分，引导用户发现问题"""
 
-    # ==================== 引导对话 ====================
-    
-    def get_guidance_prompt(self, session: Session, user_input: str) -> str:
-        """
-        生成引导对话Prompt
-        
-        这是核心的引导逻辑：
-        - 不重复同样的问题
-        - 根据用户回答动态调整
-        - 逐渐增加提示强度
-        """
-        context = session.get_context_for_llm()
-        hint_level = context['hint_level']
-        attempts_left = context['guidance_remaining']
-        
-        hint_instruction = self._get_hint_level_instruction(hint_level)
-        
-        return f"""{self.system_instruction}
-
-{self.safety_rules}
-
-【当前题目】
-{session.problem.title}
-
-{session.problem.description}
-
-【正确解法的关键点（仅供你参考，不要直接告诉用户）】
+    _GUIDANCE_RUBRIC = """【解法要点（勿直接告知用户）】
 - 这道题的核心是什么数据结构/算法？
 - 最优时间复杂度应该是多少？
 - 关键的思路转折点是什么？
 
-【用户之前提交的代码】
-```
-{session.user_code or '未提交'}
-```
-
-【引导状态】
-- 已尝试次数: {context['guidance_attempts']}
-- 剩余机会: {attempts_left}
-- 当前提示强度: {hint_level}/3
-
-【提示强度说明】
-{hint_instruction}
-
-【最近对话】
-{self._format_conversation(context['conversation_history'][-6:])}
-
-【用户最新输入】
-{user_input}
-
-【你的任务 - 严格评估并引导】
+【任务】严格评估并引导。
 
 1. **严格判断**用户是否真正理解了问题/找到了正确方向
 2. 根据用户的回答，生成下一步引导
 
-【评估标准 - user_on_right_track】
+【评估标准】user_on_right_track
 - true：用户明确提到了正确的核心思路（如正确的数据结构、算法、复杂度优化方向）
 - false：用户的思路有误、不清晰、或还没有触及核心
 
@@ -225,13 +224,13 @@ class PromptLibrary:
 - 宁可判断为false继续引导，也不要轻易判断为true
 
 请以JSON格式返回：
-{{
+{
     "user_on_right_track": true/false,
     "user_current_understanding": "用户当前思路的分析",
     "what_user_is_missing": "用户还缺少什么关键理解",
     "reply": "你的引导性回复",
     "hint_used": "你这次使用的引导策略简述"
-}}
+}
 
 关键要求：
 - 不要重复之前问过的问题
@@ -239,34 +238,7 @@ class PromptLibrary:
 - 像真人教练一样交流，不要机械化
 - 如果用户确实在正确方向上，给予肯定并鼓励他们写代码"""
 
-    # ==================== 追问生成 ====================
-    
-    def get_followup_prompt(self, session: Session, question_number: int) -> str:
-        """
-        生成追问Prompt
-        
-        代码正确后的深入问题
-        """
-        previous_questions = session.followup_state.questions_history
-        
-        return f"""{self.system_instruction}
-
-【题目】
-{session.problem.title}
-
-{session.problem.description}
-
-【用户正确的代码】
-```
-{session.user_code}
-```
-
-【已问过的追问】
-{self._format_previous_questions(previous_questions)}
-
-【当前是第 {question_number}/3 个追问】
-
-【你的任务】
+    _FOLLOWUP_RUBRIC = """【任务】
 生成一个有深度的追问问题。
 
 追问方向可以包括：
@@ -277,50 +249,18 @@ class PromptLibrary:
 - 相关算法/数据结构
 
 请以JSON格式返回：
-{{
+{
     "question": "你的追问问题",
     "expected_direction": "期望用户思考的方向",
     "difficulty": "easy/medium/hard"
-}}
+}
 
 要求：
 - 问题要具体，不要太宽泛
 - 不要和之前的追问重复
 - 自然融入对话，不要生硬"""
 
-    # ==================== 追问评估 ====================
-    
-    def get_followup_evaluation_prompt(
-        self, 
-        session: Session, 
-        question: str, 
-        user_answer: str,
-        question_number: int
-    ) -> str:
-        """
-        评估用户对追问的回答
-        """
-        return f"""{self.system_instruction}
-
-【题目】
-{session.problem.title}
-
-{session.problem.description}
-
-【用户正确的代码】
-```
-{session.user_code}
-```
-
-【追问问题】
-{question}
-
-【用户回答】
-{user_answer}
-
-【当前进度】第 {question_number}/3 个追问
-
-【你的任务 - 严格评估回答】
+    _FOLLOWUP_EVAL_RUBRIC = """【任务】严格评估回答。
 
 请仔细分析用户的回答是否正确：
 
@@ -328,7 +268,7 @@ class PromptLibrary:
 2. **答案准确性**：用户的回答在技术上是否正确？
 3. **完整性**：回答是否完整，是否遗漏重要点？
 
-【评估标准 - 必须严格遵守】
+【评估标准】
 - "good"：回答正确且完整，展示了对问题的深入理解
 - "partial"：回答部分正确，但有遗漏或小错误
 - "incorrect"：回答错误、答非所问、或存在重大误解
@@ -340,13 +280,13 @@ class PromptLibrary:
 - 宁可严格也不要放水
 
 请以JSON格式返回：
-{{
+{
     "answer_quality": "good/partial/incorrect",
     "correct_answer": "这个问题的正确答案要点（用于你自己参考）",
     "user_understanding": "用户回答中正确/错误的部分分析",
     "reply": "你的回复（包含反馈）",
     "next_question": "下一个追问问题（如果还有追问且当前回答至少partial）"
-}}
+}
 
 回复要求：
 - 如果回答正确(good)：简短肯定，然后自然过渡到下一个问题
@@ -354,48 +294,228 @@ class PromptLibrary:
 - 如果回答错误(incorrect)：温和地指出问题，给出正确方向的提示，然后继续下一个问题
 - 像真正的面试官一样交流，保持专业但友好"""
 
-    # ==================== 教学（用尽尝试后）====================
+    _TEACHING_RUBRIC = """【任务】
+1. 肯定用户的努力
+2. 解释正确的解题思路
+3. 给出参考代码
+4. 总结关键知识点
+
+请以自然的对话方式回复，包含：
+1. 鼓励的话（肯定用户的尝试）
+2. 解题思路讲解
+3. 参考代码
+4. 关键点总结
+5. 这道题的"套路"（可以迁移到什么类型的题目）
+
+注意：这是唯一允许给出完整代码的场景。语气要温和，不要让用户感到沮丧。"""
+
+    # 全局静态指令（类属性引用模块常量，实例构造不再重新拼装）
+    system_instruction = _SYSTEM_INSTRUCTION
+    safety_rules = _SAFETY_RULES
+
+    # 实例只承载下面这几个缓存容器，__slots__免掉__dict__分配
+    __slots__ = (
+        "_problem_block_cache",
+        "_static_prefix_cache",
+        "_cached_system_blocks",
+        "_static_head_cache",
+        "_prompt_cache",
+        "_snippet_cache",
+    )
+
+    def __init__(self):
+        # 按题目缓存的静态prompt片段（题库中的题目不会变化；
+        # Problem按身份哈希，直接用实例作key，比标题串更快也无碰撞）
+        self._problem_block_cache: Dict[Problem, str] = {}
+        self._static_prefix_cache: Dict[Problem, tuple] = {}
+        self._cached_system_blocks: Optional[List[Dict]] = None
+        # 各builder的静态头部（指令+题目+任务说明），按(场景, 题目)组装
+        # 一次，之后每次调用只拼接末尾的易变字段
+        self._static_head_cache: Dict[tuple, str] = {}
+        # 完整prompt的精确匹配缓存：key覆盖该prompt嵌入的全部易变输入，
+        # 同样的输入组合直接复用组装结果。嵌入对话历史的builder
+        # （意图识别、引导、教学）每轮输入必然不同，不参与缓存
+        self._prompt_cache: "OrderedDict[tuple, str]" = OrderedDict()
+        # 对话历史单条消息的渲染行缓存：按消息dict的id索引并校验content
+        # 身份（防id复用），不往公开的消息dict里写私有key
+        self._snippet_cache: "OrderedDict[int, tuple]" = OrderedDict()
     
-    def get_teaching_prompt(self, session: Session) -> str:
+    # ==================== 意图识别 ====================
+    
+    def get_intent_recognition_prompt(self, session: Session, user_input: str) -> str:
         """
-        生成教学Prompt
+        生成意图识别Prompt
         
-        当用户5次尝试都未能找到正确答案时，给出答案和详细教学
+        让LLM判断用户意图，同时生成自然的回复
         """
         context = session.get_context_for_llm()
+        problem = session.problem
+
+        # 静态内容在前（指令、题目、任务说明逐字节稳定，可命中服务端
+        # 前缀缓存），易变状态（计数器、对话、本轮输入）严格放在末尾
+        head = self._get_static_head("intent", problem)
+        return f"""{head}
+
+【当前状态】
+- 会话阶段: {context.phase}
+- 引导尝试次数: {context.guidance_attempts}/{context.guidance_remaining + context.guidance_attempts}
+- 当前提示强度: {context.hint_level}/3
+- 追问进度: {context.followup_progress}
+
+{self._format_history(context)}
+
+【用户输入】
+{user_input}"""
+
+    # ==================== 代码评估 ====================
+    
+    def get_code_evaluation_prompt(self, session: Session, code: str) -> str:
+        """
+        生成代码评估Prompt
         
-        return f"""{self.system_instruction}
+        评估用户代码是否正确，并生成相应回复
+        """
+        problem = session.problem
+
+        key = ("code_eval", problem.title, code)
+        cached = self._get_cached_prompt(key)
+        if cached is not None:
+            return cached
+
+        return self._store_prompt(key, f"""{self._get_static_head("code_eval", problem)}
+
+【用户代码】
+```
+{code}
+```""")
+
+    # ==================== 引导对话 ====================
+    
+    def get_guidance_prompt(self, session: Session, user_input: str) -> str:
+        """
+        生成引导对话Prompt
+        
+        这是核心的引导逻辑：
+        - 不重复同样的问题
+        - 根据用户回答动态调整
+        - 逐渐增加提示强度
+        """
+        context = session.get_context_for_llm()
+        hint_level = context.hint_level
+        attempts_left = context.guidance_remaining
 
-【重要】用户已经尝试了5次，现在需要给出答案和教学。
-在这个特殊情况下，你可以解释正确的解法。
+        # 上下文指纹覆盖代码/计数器/对话等全部易变输入，
+        # 同样状态下的重复构建（如UI双击触发的重试）直接复用
+        key = ("guidance", session.problem, session._context_fingerprint(), user_input)
+        cached = self._get_cached_prompt(key)
+        if cached is not None:
+            return cached
 
-【题目】
-{session.problem.title}
+        hint_instruction = self._get_hint_level_instruction(hint_level)
 
-{session.problem.description}
+        return self._store_prompt(key, f"""{self._get_static_head("guidance", session.problem)}
 
-【用户尝试的代码】
+【用户代码】
 ```
-{session.user_code or '未提交代码'}
+{session.user_code or '未提交'}
 ```
 
-【对话历史】
-{self._format_conversation(context['conversation_history'][-10:])}
+【提示强度说明】
+{hint_instruction}
 
-【你的任务】
-1. 肯定用户的努力
-2. 解释正确的解题思路
-3. 给出参考代码
-4. 总结关键知识点
+【引导状态】
+- 已尝试次数: {context.guidance_attempts}
+- 剩余机会: {attempts_left}
+- 当前提示强度: {hint_level}/3
 
-请以自然的对话方式回复，包含：
-1. 鼓励的话（肯定用户的尝试）
-2. 解题思路讲解
-3. 参考代码
-4. 关键点总结
-5. 这道题的"套路"（可以迁移到什么类型的题目）
+{self._format_history(context, limit=6)}
 
-注意：这是唯一允许给出完整代码的场景。语气要温和，不要让用户感到沮丧。"""
+【用户最新输入】
+{user_input}""")
+
+    # ==================== 追问生成 ====================
+    
+    def get_followup_prompt(self, session: Session, question_number: int) -> str:
+        """
+        生成追问Prompt
+        
+        代码正确后的深入问题
+        """
+        previous_questions = session.followup_state.questions_history
+
+        key = (
+            "followup", session.problem.title, session.user_code,
+            tuple(previous_questions), question_number
+        )
+        cached = self._get_cached_prompt(key)
+        if cached is not None:
+            return cached
+
+        return self._store_prompt(key, f"""{self._get_static_head("followup", session.problem)}
+
+【用户代码】
+```
+{session.user_code}
+```
+
+【已问过的追问】
+{self._format_previous_questions(previous_questions)}
+
+【追问进度】{question_number}/3""")
+
+    # ==================== 追问评估 ====================
+    
+    def get_followup_evaluation_prompt(
+        self, 
+        session: Session, 
+        question: str, 
+        user_answer: str,
+        question_number: int
+    ) -> str:
+        """
+        评估用户对追问的回答
+        """
+        key = (
+            "followup_eval", session.problem.title, session.user_code,
+            question, user_answer, question_number
+        )
+        cached = self._get_cached_prompt(key)
+        if cached is not None:
+            return cached
+
+        return self._store_prompt(key, f"""{self._get_static_head("followup_eval", session.problem)}
+
+【用户代码】
+```
+{session.user_code}
+```
+
+【追问进度】{question_number}/3
+
+【追问问题】
+{question}
+
+【用户回答】
+{user_answer}""")
+
+    # ==================== 教学（用尽尝试后）====================
+    
+    def get_teaching_prompt(self, session: Session) -> str:
+        """
+        生成教学Prompt
+        
+        当用户5次尝试都未能找到正确答案时，给出答案和详细教学
+        """
+        context = session.get_context_for_llm()
+        
+        return f"""{self._get_static_head("teaching", session.problem)}
+
+【用户代码】
+```
+{session.user_code or '未提交代码'}
+```
+
+{self._format_history(context, limit=10)}"""
 
     # ==================== 帮助请求处理 ====================
     
@@ -406,65 +526,195 @@ class PromptLibrary:
         用户说"我不会"、"给我提示"等
         """
         context = session.get_context_for_llm()
-        hint_level = context['hint_level']
-        
-        return f"""{self.system_instruction}
-
-{self.safety_rules}
+        hint_level = context.hint_level
 
-【题目】
-{session.problem.title}
+        key = (
+            "help", session.problem.title, hint_level,
+            session.user_code, user_input
+        )
+        cached = self._get_cached_prompt(key)
+        if cached is not None:
+            return cached
 
-{session.problem.description}
+        return self._store_prompt(key, f"""{self.system_instruction}
 
-【用户已提交的代码（如果有）】
-```
-{session.user_code or '尚未提交'}
-```
-
-【用户请求】
-{user_input}
+{self.safety_rules}
 
-【当前提示强度】{hint_level}/3
+{self._get_problem_block(session.problem)}
 
-【你的任务】
+【任务】
 用户请求帮助，给出适当的引导。
 
-提示强度 {hint_level} 的要求：
-{self._get_hint_level_instruction(hint_level)}
-
 请以JSON格式返回：
 {{
     "reply": "你的引导性回复",
     "hint_type": "你使用的提示类型"
 }}
 
-记住：即使用户请求帮助，也不要直接给答案。给出引导性的问题或提示。"""
+记住：即使用户请求帮助，也不要直接给答案。给出引导性的问题或提示。
+
+【当前提示强度】{hint_level}/3
+
+提示强度 {hint_level} 的要求：
+{self._get_hint_level_instruction(hint_level)}
+
+【已提交代码（如有）】
+```
+{session.user_code or '尚未提交'}
+```
+
+【用户请求】
+{user_input}""")
 
     # ==================== 辅助方法 ====================
-    
-    def _format_conversation(self, messages: List[Dict]) -> str:
-        """格式化对话历史"""
+
+    def _get_cached_prompt(self, key: tuple) -> Optional[str]:
+        """查完整prompt缓存，命中时更新LRU位置"""
+        cached = self._prompt_cache.get(key)
+        if cached is not None:
+            self._prompt_cache.move_to_end(key)
+        return cached
+
+    def _store_prompt(self, key: tuple, prompt: str) -> str:
+        """写入完整prompt缓存（超容量时淘汰最久未用的）"""
+        self._prompt_cache[key] = prompt
+        if len(self._prompt_cache) > self.PROMPT_CACHE_SIZE:
+            self._prompt_cache.popitem(last=False)
+        return prompt
+
+    def _get_problem_block(self, problem: Optional[Problem]) -> str:
+        """【题目】片段（标题+描述，每道题只拼一次）"""
+        if problem is None:
+            return "【题目】\n未设置\n\n"
+        block = self._problem_block_cache.get(problem)
+        if block is None:
+            block = f"【题目】\n{problem.title}\n\n{problem.description}"
+            self._problem_block_cache[problem] = block
+        return block
+
+    def _get_static_head(self, scene: str, problem: Optional[Problem]) -> str:
+        """按(场景, 题目)组装并缓存builder的静态头部
+
+        指令、题目、任务说明在整个会话期间逐字节不变，组装一次后
+        每轮调用只需把易变的尾部拼上来，不再重建几KB的常量文本。
+        """
+        key = (scene, problem)
+        head = self._static_head_cache.get(key)
+        if head is None:
+            block = self._get_problem_block(problem)
+            if scene == "intent":
+                head = (f"{self.system_instruction}\n\n{self.safety_rules}\n\n"
+                        f"{block}\n\n{self._INTENT_RUBRIC}")
+            elif scene == "code_eval":
+                head = (f"{self.system_instruction}\n\n{self.safety_rules}\n\n"
+                        f"{block}\n\n"
+                        f"【期望复杂度】\n{problem.expected_complexity or '未指定'}\n\n"
+                        f"【测试用例】\n{problem.formatted_test_cases()}\n\n"
+                        f"{self._CODE_EVAL_RUBRIC}")
+            elif scene == "guidance":
+                head = (f"{self.system_instruction}\n\n{self.safety_rules}\n\n"
+                        f"{block}\n\n{self._GUIDANCE_RUBRIC}")
+            elif scene == "followup":
+                head = f"{self.system_instruction}\n\n{block}\n\n{self._FOLLOWUP_RUBRIC}"
+            elif scene == "followup_eval":
+                head = f"{self.system_instruction}\n\n{block}\n\n{self._FOLLOWUP_EVAL_RUBRIC}"
+            else:  # teaching
+                head = (f"{self.system_instruction}\n\n"
+                        "【重要】用户已经尝试了5次，现在需要给出答案和教学。\n"
+                        "在这个特殊情况下，你可以解释正确的解法。\n\n"
+                        f"{block}\n\n{self._TEACHING_RUBRIC}")
+            self._static_head_cache[key] = head
+        return head
+
+    def get_candidate_heads(self, problem: Problem) -> tuple:
+        """下一轮最可能用到的两个builder的静态头部（引导、代码评估）
+
+        供投机预热使用：用户在等代码/引导阶段打字时，下一条输入
+        大概率是继续讨论思路或提交代码。提前把这两个头部写入
+        provider端前缀缓存，真实请求到达时prefill直接按缓存命中。
+        """
+        return (
+            self._get_static_head("guidance", problem),
+            self._get_static_head("code_eval", problem),
+        )
+
+    def get_static_prefixes(self, problem: Problem) -> tuple:
+        """按题目返回逐字节稳定的prompt前缀（从长到短）
+
+        各builder的开头都是 系统指令(+安全规则)+题目块 的组合，
+        这些片段在整个会话期间逐字节不变。客户端可以把命中的
+        前缀拆出来作为system prompt单独发送，让provider端的
+        前缀缓存在每一轮都命中，而不是被易变的后缀打断。
+        """
+        cached = self._static_prefix_cache.get(problem)
+        if cached is None:
+            block = self._get_problem_block(problem)
+            cached = (
+                f"{self.system_instruction}\n\n{self.safety_rules}\n\n{block}",
+                f"{self.system_instruction}\n\n{block}",
+                self.system_instruction,
+            )
+            self._static_prefix_cache[problem] = cached
+        return cached
+
+    def build_cached_system(self) -> List[Dict]:
+        """以结构化块返回全局静态前言（系统指令+安全规则）
+
+        块上带Anthropic风格的cache_control标记，支持块列表system参数
+        的客户端可以直接透传，让这段逐字节不变的前言只做一次前缀写入；
+        其他provider忽略标记，靠稳定的前缀顺序命中自动缓存。
+        """
+        if self._cached_system_blocks is None:
+            self._cached_system_blocks = [{
+                "type": "text",
+                "text": f"{self.system_instruction}\n\n{self.safety_rules}",
+                "cache_control": {"type": "ephemeral"},
+            }]
+        return self._cached_system_blocks
+
+    def _format_history(self, context: LLMContext, limit: int = None) -> str:
+        """对话历史块：稳定的滚动摘要在前，最近对话在后
+
+        摘要每积累多轮才更新一次（见引擎的_maybe_summarize），
+        放在易变的最近对话之前，能让provider端前缀缓存在两次
+        摘要更新之间多覆盖一段；旧对话被token预算截掉时，
+        关键结论也仍通过摘要保留在上下文里。
+        """
+        recent = f"【最近对话】\n{self._format_conversation(context.conversation_history, limit)}"
+        summary = context.history_summary
+        if summary:
+            return f"【历史摘要】\n{summary}\n\n{recent}"
+        return recent
+
+    def _format_conversation(self, messages: List[Dict], limit: int = None) -> str:
+        """格式化对话历史
+
+        limit限定只渲染最近N条，工作量与会话总长无关；
+        每条消息的格式化结果按消息dict的id缓存（消息写入后不再
+        变化），跨轮重复渲染时直接复用截断好的行。缓存放在库侧，
+        不污染 Message.to_dict() 返回并被各处共享的dict。
+        """
+        if limit is not None:
+            messages = messages[-limit:]
         if not messages:
             return "（无历史对话）"
-        
+
+        cache = self._snippet_cache
         lines = []
         for msg in messages:
+            content = msg['content']
+            cached = cache.get(id(msg))
+            if cached is not None and cached[0] is content:
+                lines.append(cached[1])
+                continue
             role = "用户" if msg['role'] == 'user' else "教练"
-            content = msg['content'][:200] + "..." if len(msg['content']) > 200 else msg['content']
-            lines.append(f"{role}: {content}")
-        
-        return "\n".join(lines)
-    
-    def _format_test_cases(self, test_cases: List[Dict]) -> str:
-        """格式化测试用例"""
-        if not test_cases:
-            return "（无测试用例）"
-        
-        lines = []
-        for i, tc in enumerate(test_cases, 1):
-            lines.append(f"用例{i}: 输入={tc.get('input', 'N/A')}, 期望输出={tc.get('output', 'N/A')}")
-        
+            snippet = content[:200] + "..." if len(content) > 200 else content
+            line = f"{role}: {snippet}"
+            cache[id(msg)] = (content, line)
+            if len(cache) > self.PROMPT_CACHE_SIZE:
+                cache.popitem(last=False)
+            lines.append(line)
+
         return "\n".join(lines)
     
     def _format_previous_questions(self, questions: List[str]) -> str:
@@ -475,34 +725,15 @@ class PromptLibrary:
         return "\n".join([f"- {q}" for q in questions])
     
     def _get_hint_level_instruction(self, level: int) -> str:
-        """获取不同提示强度的说明"""
-        instructions = {
-            1: '''【轻度提示 - Level 1】
-- 只问引导性问题
-- 不给任何具体方向
-- 例如："你觉得这个问题的核心难点是什么？"''',
-            
-            2: '''【中度提示 - Level 2】
-- 可以暗示思考方向
-- 可以提及相关的数据结构或算法类型（但不说具体用法）
-- 例如："有没有什么数据结构可以帮助快速查找？"''',
-            
-            3: '''【重度提示 - Level 3】
-- 可以更明确地指出方向
-- 可以用类比解释
-- 但仍然不能给出代码
-- 例如："这道题的关键是用空间换时间，哈希表可以帮助你在O(1)时间内查找...你能想到怎么用吗？"'''
-        }
-        return instructions.get(level, instructions[1])
+        """获取不同提示强度的说明（查模块级常量表）"""
+        return _HINT_INSTRUCTIONS.get(level, _HINT_INSTRUCTIONS[1])
 
 
 # ==================== 全局实例 ====================
 
-_prompt_library = None
+# 构造只初始化几个空缓存容器，导入时直接建好，取用时零分支
+_prompt_library = PromptLibrary()
 
 def get_prompt_library() -> PromptLibrary:
     """获取Prompt库单例"""
-    global _prompt_library
-    if _prompt_library is None:
-        _prompt_library = PromptLibrary()
     return _prompt_library
@@ -8,6 +8,7 @@
 4. 5次未答对 → 教学流程
 """
 
+import asyncio
 import sys
 import os
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -270,10 +271,9 @@ class TestCoachEngine:
     
     def test_incorrect_code_flow(self):
         """测试代码错误的流程"""
-        # 重新创建mock以清除之前的设置
-        self.mock_llm = MockLLMClient()
-        set_llm_client(self.mock_llm)
-        self.engine = CoachEngine()
+        # 复用实例，只清掉之前的预设和会话
+        self.mock_llm.reset()
+        self.engine.reset_sessions()
         
         # 设置Mock返回错误评估
         self.mock_llm.set_response("评估代码", {
@@ -396,7 +396,7 @@ class TestIntegration:
         set_llm_client(self.mock_llm)
         self.engine = CoachEngine()
     
-    def test_full_correct_flow(self):
+    async def test_full_correct_flow(self):
         """测试完整的正确代码流程"""
         print("\n--- 测试：完整正确代码流程 ---")
         
@@ -413,7 +413,7 @@ class TestIntegration:
         })
         
         # 提交正确代码
-        response = self.engine.process_input(
+        response = await self.engine.aprocess_input(
             session.session_id,
             "def two_sum(nums, target): seen = {}; ..."
         )
@@ -424,7 +424,7 @@ class TestIntegration:
         
         # 回答追问
         for i in range(3):
-            response = self.engine.process_input(
+            response = await self.engine.aprocess_input(
                 session.session_id,
                 f"时间复杂度是O(n)，因为..."
             )
@@ -434,7 +434,7 @@ class TestIntegration:
         assert session.phase == SessionPhase.COMPLETED
         print("✓ test_full_correct_flow")
     
-    def test_full_guidance_flow(self):
+    async def test_full_guidance_flow(self):
         """测试完整的引导流程"""
         print("\n--- 测试：完整引导流程 ---")
         
@@ -443,7 +443,7 @@ class TestIntegration:
         self.engine.set_problem(session.session_id, TWO_SUM)
         
         # 请求帮助
-        response = self.engine.process_input(
+        response = await self.engine.aprocess_input(
             session.session_id,
             "我不知道怎么做"
         )
@@ -454,7 +454,7 @@ class TestIntegration:
         
         # 多次尝试
         for i in range(4):
-            response = self.engine.process_input(
+            response = await self.engine.aprocess_input(
                 session.session_id,
                 "我想用两个循环遍历"
             )
@@ -464,7 +464,7 @@ class TestIntegration:
         assert session.phase == SessionPhase.TEACHING
         print("✓ test_full_guidance_flow")
     
-    def test_mid_guidance_correct(self):
+    async def test_mid_guidance_correct(self):
         """测试引导中途提交正确代码"""
         print("\n--- 测试：引导中途提交正确代码 ---")
         
@@ -472,7 +472,7 @@ class TestIntegration:
         self.engine.set_problem(session.session_id, TWO_SUM)
         
         # 进入引导
-        self.engine.process_input(session.session_id, "给我提示")
+        await self.engine.aprocess_input(session.session_id, "给我提示")
         assert session.phase == SessionPhase.GUIDING
         
         # 设置正确评估
@@ -483,7 +483,7 @@ class TestIntegration:
         })
         
         # 提交正确代码
-        response = self.engine.process_input(
+        response = await self.engine.aprocess_input(
             session.session_id,
             "def two_sum(nums, target): return correct_solution()"
         )
@@ -493,14 +493,50 @@ class TestIntegration:
         print("✓ test_mid_guidance_correct")
     
     def run_all(self):
-        """运行所有集成测试"""
+        """运行所有集成测试
+
+        三个场景相互独立（各自的会话），默认用asyncio.gather
+        并发执行；COACH_TEST_PARALLEL=1可退回顺序执行便于排查。
+        """
         print("\n=== 集成测试 ===")
-        self.test_full_correct_flow()
-        self.test_full_guidance_flow()
-        self.test_mid_guidance_correct()
+        tests = (
+            self.test_full_correct_flow,
+            self.test_full_guidance_flow,
+            self.test_mid_guidance_correct,
+        )
+
+        async def _run():
+            if os.environ.get("COACH_TEST_PARALLEL", "3") == "1":
+                for test in tests:
+                    await test()
+            else:
+                await asyncio.gather(*(test() for test in tests))
+
+        asyncio.run(_run())
         print("\n集成测试全部通过！\n")
 
 
+def test_mock_code_fences_compile():
+    """Mock默认响应里的```python代码块必须是合法Python
+
+    教学等canned响应会原样展示给用户，缩进错误不会被
+    其他测试发现，这里逐块compile兜底。
+    """
+    from src.llm_client import _DEFAULT_RESPONSES
+
+    for value in _DEFAULT_RESPONSES.values():
+        texts = value.values() if isinstance(value, dict) else [value]
+        for text in texts:
+            if not isinstance(text, str):
+                continue
+            rest = text
+            while "```python" in rest:
+                _, _, rest = rest.partition("```python")
+                code, _, rest = rest.partition("```")
+                compile(code, "<mock-response>", "exec")
+    print("✓ test_mock_code_fences_compile")
+
+
 def run_all_tests():
     """运行所有测试"""
     print("=" * 60)
@@ -516,6 +552,9 @@ def run_all_tests():
     # 引擎测试
     TestCoachEngine().run_all()
     
+    # Mock响应体检
+    test_mock_code_fences_compile()
+
     # 集成测试
     TestIntegration().run_all()
     